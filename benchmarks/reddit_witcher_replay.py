@@ -0,0 +1,556 @@
+"""
+Replays captured Reddit Witcher traffic against the workers and views
+
+Reads a capture written by utils/reddit_witcher_capture.py and replays it
+offline. Reddit is replaced by an in-process fake, Haptik by a local HTTP stub
+server, and Redis is the one in the local Django settings, with the bot state
+kept under a namespace of its own for every run. Comments become visible on
+the fake thread at their original pace divided by --speed, and --load copies
+every comment to simulate busier threads. Like Reddit, the fake returns about
+200 comments per listing, cuts threads off at a depth of 10 and pages the rest
+behind MoreComments stubs that return about 100 comments per morechildren
+call, so the reported API calls include the crawl's expansions. The crawl and
+send-replies workers run on the cron schedule, also scaled by --speed.
+The stub calls the HaptikToRedditAdapter view with the captured webhook
+bodies after their captured delays, counted from when the crawl has mapped the
+message to its comment, like Haptik can only answer after it responded.
+
+Reports throughput, end-to-end latency from comment posted to reply posted,
+Redis command counts and API call counts.
+
+Usage:
+    python reddit_witcher_replay.py capture.jsonl --speed 10 --load 10
+"""
+from __future__ import absolute_import
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from praw.models import MoreComments  # noqa: E402
+from integration.const import reddit_witcher as const  # noqa: E402
+from integration.utils import reddit_witcher  # noqa: E402
+from integration.utils.reddit_witcher_state import RedditWitcherState  # noqa: E402
+from integration.views import reddit_witcher as views  # noqa: E402
+
+BOT_NAME = "reddit_witcher_replay_bot"
+DEFAULT_REPLY = "Toss a coin to your Witcher"
+# Reddit's limits for a comment listing and a morechildren call
+LISTING_LIMIT = 200
+LISTING_DEPTH = 10
+MORECHILDREN_LIMIT = 100
+WEBHOOK_MIN_DELAY = 0.05
+WEBHOOK_MAPPING_TIMEOUT = 10
+WEBHOOK_POLL_INTERVAL = 0.01
+
+
+class ReplayComment:
+    def __init__(self, comment_id, author, body, arrival, haptik_latency, webhooks):
+        """
+        :param comment_id: str
+        :param author: str
+        :param body: str
+        :param arrival: float, seconds after the first captured comment
+        :param haptik_latency: float, seconds send_message took when captured
+        :param webhooks: List of (delay after send_message in seconds, webhook body)
+        """
+        self.id = comment_id
+        self.author = author
+        self.body = body
+        self.arrival = arrival
+        self.haptik_latency = haptik_latency
+        self.webhooks = webhooks
+
+
+def load_capture(path: str):
+    """
+    Joins captured comments, send_message responses and webhooks by comment and message id
+    :param path: str
+    :return: List of ReplayComment ordered by arrival
+    """
+    comments = {}
+    responses = {}
+    webhooks = defaultdict(list)
+    with open(path) as capture_file:
+        for line in capture_file:
+            record = json.loads(line)
+            if record["kind"] == "comment":
+                comment = record["comment"]
+                if comment["id"] not in comments:
+                    comments[comment["id"]] = (record["created_utc"], comment)
+            elif record["kind"] == "haptik_response":
+                responses.setdefault(record["comment_id"], record)
+            elif record["kind"] == "haptik_webhook":
+                message_id = record["body"].get("user_message_info", {}).get("id")
+                webhooks[str(message_id)].append(record)
+
+    if not comments:
+        return []
+    first_created = min(created for created, _ in comments.values())
+    replay_comments = []
+    for comment_id, (created, comment) in comments.items():
+        response = responses.get(comment_id)
+        latency = 0
+        comment_webhooks = []
+        if response:
+            latency = response["latency"]
+            message_id = str((response["body"] or {}).get("message_id"))
+            comment_webhooks = [
+                (max(webhook["ts"] - response["ts"], 0), webhook["body"]) for webhook in webhooks.get(message_id, [])
+            ]
+        replay_comments.append(ReplayComment(
+            comment_id, comment["author"], comment["body"], created - first_created, latency, comment_webhooks
+        ))
+    return sorted(replay_comments, key=lambda c: c.arrival)
+
+
+def multiply_load(comments: list, load: int, run_tag: str):
+    """
+    Copies every comment load times under ids that are unique within the run
+    :return: List of ReplayComment
+    """
+    copies = []
+    for comment in comments:
+        for n in range(load):
+            copies.append(ReplayComment(
+                f"{comment.id}{run_tag}{n}", comment.author, comment.body,
+                comment.arrival, comment.haptik_latency, comment.webhooks
+            ))
+    return copies
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Clock:
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.started = time.monotonic()
+
+    def replay_seconds(self):
+        """
+        :return: float, seconds elapsed on the captured timeline
+        """
+        return (time.monotonic() - self.started) * self.speed
+
+
+class FakeRedditor:
+    def __init__(self, name: str):
+        self.name = name
+        self.id = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeComment:
+    def __init__(self, reddit, comment_id, author, body, created_utc, parent_id):
+        self._reddit = reddit
+        self.id = comment_id
+        self.fullname = f"t1_{comment_id}"
+        self.author = FakeRedditor(author)
+        self.body = body
+        self.created_utc = created_utc
+        self.parent_id = parent_id
+        self.banned_by = None
+        self.replies = []
+
+    def reply(self, body):
+        self._reddit.count("reply")
+        reply = FakeComment(self._reddit, f"{self.id}_r{len(self.replies)}", BOT_NAME, body, time.time(),
+                            self.fullname)
+        self.replies.append(reply)
+        self._reddit.replied(self.id)
+        return reply
+
+
+class ListedComment:
+    """
+    A comment as it appears in one listing, with its replies cut off like Reddit does
+    """
+
+    def __init__(self, comment: FakeComment, replies: list):
+        self._comment = comment
+        self.replies = replies
+
+    def __getattr__(self, name):
+        return getattr(self._comment, name)
+
+
+class FakeMoreComments(MoreComments):
+    """
+    Stub standing in for comments left out of a listing, each expansion counts as one API call
+    """
+
+    def __init__(self, reddit, parent_id: str, comments: list, depth: int, continue_thread=False):
+        """
+        :param reddit: FakeReddit
+        :param parent_id: str, fullname of the parent of the hidden comments
+        :param comments: List of FakeComment hidden behind the stub
+        :param depth: int, depth of the hidden comments in the thread
+        :param continue_thread: bool, "continue this thread" stubs have a count of 0 on Reddit
+        """
+        count = 0 if continue_thread else sum(1 + count_descendants(comment) for comment in comments)
+        super().__init__(None, {
+            "id": "_" if continue_thread else comments[0].id,
+            "parent_id": parent_id,
+            "count": count,
+            "children": [] if continue_thread else [comment.id for comment in comments],
+        })
+        self._fake_reddit = reddit
+        self._hidden = comments
+        self._depth = depth
+        self._continue_thread = continue_thread
+
+    def comments(self, update=True):
+        if self._continue_thread:
+            self._fake_reddit.count("continue_thread")
+            return self._fake_reddit.listing(self._hidden, self.parent_id, 0, LISTING_LIMIT)
+        self._fake_reddit.count("morechildren")
+        return self._fake_reddit.listing(self._hidden, self.parent_id, self._depth, MORECHILDREN_LIMIT)
+
+
+def count_descendants(comment: FakeComment):
+    return sum(1 + count_descendants(reply) for reply in list(comment.replies))
+
+
+class FakeSubmission:
+    def __init__(self, reddit, submission_id):
+        self._reddit = reddit
+        self.id = submission_id
+        self.fullname = f"t3_{submission_id}"
+        self.created_utc = reddit.created_utc
+        self.comment_sort = "best"
+
+    @property
+    def comments(self):
+        return self._reddit.listing(self._reddit.visible_comments(), self.fullname, 0, LISTING_LIMIT)
+
+
+class FakeAuth:
+    @property
+    def limits(self):
+        return {"remaining": 600, "reset_timestamp": time.time() + 600}
+
+
+class FakeUser:
+    def me(self):
+        return FakeRedditor(BOT_NAME)
+
+
+class FakeReddit:
+    """
+    The part of praw.Reddit used by the Reddit Witcher services, backed by replay comments
+    """
+
+    def __init__(self, comments: list, clock: Clock):
+        self.clock = clock
+        self.created_utc = time.time()
+        self.auth = FakeAuth()
+        self.user = FakeUser()
+        self.calls = Counter()
+        self.replied_at = {}
+        self._lock = threading.Lock()
+        self._pending = list(comments)
+        self._visible = []
+        self._by_id = {}
+        self.arrived_at = {}
+
+    def count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    def visible_comments(self):
+        """
+        Publishes every comment whose captured arrival has been reached
+        """
+        now = self.clock.replay_seconds()
+        with self._lock:
+            while self._pending and self._pending[0].arrival <= now:
+                comment = self._pending.pop(0)
+                fake = FakeComment(self, comment.id, comment.author, comment.body,
+                                   self.created_utc + comment.arrival, f"t3_{const.submission_id}")
+                self._visible.insert(0, fake)
+                self._by_id[comment.id] = fake
+                self.arrived_at[comment.id] = self.clock.started + comment.arrival / self.clock.speed
+            return list(self._visible)
+
+    def listing(self, comments: list, parent_id: str, depth: int, limit: int):
+        """
+        Comment forest of one response: at most limit comments, depth first, the rest behind stubs
+        :param comments: List of FakeComment under parent_id
+        :param parent_id: str
+        :param depth: int, depth of comments in the thread
+        :param limit: int
+        :return: List of ListedComment and FakeMoreComments
+        """
+        remaining = [limit]
+
+        def build(siblings, parent, level):
+            items = []
+            for n, comment in enumerate(siblings):
+                if remaining[0] <= 0:
+                    items.append(FakeMoreComments(self, parent, siblings[n:], level))
+                    break
+                remaining[0] -= 1
+                replies = list(comment.replies)
+                if replies and level + 1 >= LISTING_DEPTH:
+                    children = [FakeMoreComments(self, comment.fullname, replies, level + 1, continue_thread=True)]
+                else:
+                    children = build(replies, comment.fullname, level + 1)
+                items.append(ListedComment(comment, children))
+            return items
+
+        return build(comments, parent_id, depth)
+
+    def submission(self, submission_id):
+        self.count("submission")
+        return FakeSubmission(self, submission_id)
+
+    def comment(self, id):
+        self.count("comment")
+        return self._by_id[id]
+
+    def replied(self, comment_id: str):
+        with self._lock:
+            self.replied_at.setdefault(comment_id, time.monotonic())
+
+
+class StubHaptik:
+    """
+    Local HTTP server answering the Haptik endpoints and sending captured webhooks back to the view
+    """
+
+    def __init__(self, comments: list, speed: float, error_rate: float, state: RedditWitcherState,
+                 state_namespace: str):
+        self.comments_by_auth_id = {comment.author + comment.id: comment for comment in comments}
+        self.state = state
+        self.speed = speed
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.view_latencies = []
+        self._message_ids = itertools.count(10 ** 9)
+        self._lock = threading.Lock()
+        self._request_factory = RequestFactory()
+        self._view = views.HaptikToRedditAdapter.as_view(state_namespace=state_namespace)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+
+    def deliver_webhook(self, body: dict):
+        request = self._request_factory.post(
+            "/haptik_to_reddit_adapter/", data=json.dumps(body), content_type="application/json"
+        )
+        started = time.monotonic()
+        self._view(request)
+        with self._lock:
+            self.calls["webhook"] += 1
+            self.view_latencies.append(time.monotonic() - started)
+
+    def deliver_webhooks(self, message_id: int, webhooks: list):
+        """
+        Waits until the message is mapped to its comment, then delivers the webhooks after their delays
+
+        The mapping is only written once the send_message response has been read, so
+        delivering earlier would make the view drop the reply as an unknown message.
+        :param message_id: int
+        :param webhooks: List of (delay in seconds at capture pace, webhook body)
+        """
+        timeout = time.monotonic() + WEBHOOK_MAPPING_TIMEOUT
+        while True:
+            self.count("mapping_poll")
+            if self.state.get_comment_for_message(message_id):
+                break
+            if time.monotonic() >= timeout:
+                self.count("webhook_unmapped")
+                break
+            time.sleep(WEBHOOK_POLL_INTERVAL)
+        mapped = time.monotonic()
+        for delay, body in sorted(webhooks, key=lambda webhook: webhook[0]):
+            time.sleep(max(mapped + max(delay / self.speed, WEBHOOK_MIN_DELAY) - time.monotonic(), 0))
+            self.deliver_webhook(body)
+
+    def send_message(self, payload: dict):
+        """
+        :return: (status code, response body)
+        """
+        comment = self.comments_by_auth_id.get(payload.get("user", {}).get("auth_id"))
+        if comment:
+            time.sleep(comment.haptik_latency / self.speed)
+        message_id = next(self._message_ids)
+        webhooks = comment.webhooks if comment and comment.webhooks else [
+            (0, {"message": {"body": {"text": DEFAULT_REPLY}}})
+        ]
+        webhooks = [
+            (delay, dict(body, user_message_info=dict(body.get("user_message_info", {}), id=message_id)))
+            for delay, body in webhooks
+        ]
+        threading.Thread(target=self.deliver_webhooks, args=(message_id, webhooks), daemon=True).start()
+        return 200, {"message_id": message_id}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if random.random() < stub.error_rate:
+                    stub.count("injected_error")
+                    status, body = 503, {"error": "injected"}
+                elif self.path.endswith("/user/"):
+                    stub.count("create_user")
+                    status, body = 200, {"success": True}
+                elif self.path.endswith("/log_message_from_user/"):
+                    stub.count("send_message")
+                    status, body = stub.send_message(payload)
+                else:
+                    status, body = 404, {}
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def redis_command_calls(redis_client):
+    """
+    :return: int, commands processed by the server so far
+    """
+    return sum(stats["calls"] for stats in redis_client.info("commandstats").values())
+
+
+def run_periodically(name: str, interval: float, func, stop: threading.Event, errors: Counter):
+    while not stop.is_set():
+        try:
+            func()
+        except Exception as e:
+            errors[f"{name}: {type(e).__name__}"] += 1
+        stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="JSON lines file written by the traffic recorder")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed multiple")
+    parser.add_argument("--load", type=int, default=1, help="copies of every captured comment")
+    parser.add_argument("--crawl-interval", type=float, default=60, help="cron interval of the crawl, seconds")
+    parser.add_argument("--reply-interval", type=float, default=60, help="cron interval of send replies, seconds")
+    parser.add_argument("--drain-timeout", type=float, default=60,
+                        help="wall seconds to wait for replies after the last comment arrived")
+    parser.add_argument("--haptik-error-rate", type=float, default=0, help="share of Haptik calls answered 503")
+    parser.add_argument("--keep-state", action="store_true", help="keep the Redis keys of the run for inspection")
+    args = parser.parse_args()
+
+    if settings.HAPTIK_ENV == "production":
+        raise SystemExit("Refusing to replay against production settings")
+
+    run_tag = f"x{int(time.time()):x}"
+    comments = multiply_load(load_capture(args.capture), args.load, run_tag)
+    if not comments:
+        raise SystemExit("No comments in capture")
+
+    clock = Clock(args.speed)
+    reddit = FakeReddit(comments, clock)
+    # A namespace per run keeps the replay away from the live bot state and from earlier replays
+    namespace = f"{const.redis_namespace}_replay_{run_tag}"
+    state = RedditWitcherState(namespace=namespace)
+    haptik = StubHaptik(comments, args.speed, args.haptik_error_rate, state=state, state_namespace=namespace)
+    haptik.start()
+    const.haptik_preprod_create_user_url = f"{haptik.base_url}/v1.0/user/"
+    const.haptik_preprod_send_msg_url = f"{haptik.base_url}/v1.0/log_message_from_user/"
+
+    haptik_service = reddit_witcher.RedditToHaptikAdapter.HaptikService(reddit=reddit, state=state)
+    haptik_service.bot_name = BOT_NAME
+    reddit_service = reddit_witcher.HaptikToRedditAdapter.RedditService(reddit=reddit, state=state)
+
+    def crawl():
+        reddit_witcher.RedditToHaptikAdapter.RedditToHaptikService(
+            {"type": "respond_comments"}, haptik_service=haptik_service
+        ).worker()
+
+    def send_replies():
+        reddit_witcher.HaptikToRedditAdapter.HaptikToRedditService(
+            payload={}, reddit_service=reddit_service
+        ).worker_v2()
+
+    redis_calls_before = redis_command_calls(state.redis)
+    stop = threading.Event()
+    errors = Counter()
+    workers = [
+        threading.Thread(target=run_periodically, args=("crawl", args.crawl_interval / args.speed, crawl, stop, errors)),
+        threading.Thread(target=run_periodically,
+                         args=("send_replies", args.reply_interval / args.speed, send_replies, stop, errors)),
+    ]
+    for worker in workers:
+        worker.start()
+
+    last_arrival = clock.started + comments[-1].arrival / args.speed
+    while time.monotonic() < last_arrival + args.drain_timeout and len(reddit.replied_at) < len(comments):
+        time.sleep(0.1)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    haptik.stop()
+    elapsed = time.monotonic() - clock.started
+    # The stub's own mapping polls are not bot traffic
+    redis_calls = redis_command_calls(state.redis) - redis_calls_before - haptik.calls["mapping_poll"]
+    if not args.keep_state:
+        for key in state.redis.scan_iter(match=state.key("*"), count=500):
+            state.redis.delete(key)
+
+    latencies = [
+        replied - reddit.arrived_at[comment_id]
+        for comment_id, replied in reddit.replied_at.items() if comment_id in reddit.arrived_at
+    ]
+    print(f"comments={len(comments)} replied={len(reddit.replied_at)} speed={args.speed} load={args.load}")
+    print(f"elapsed={elapsed:.1f}s throughput={len(reddit.replied_at) / elapsed:.2f} replies/s")
+    for pct in (50, 95, 99, 100):
+        value = percentile(latencies, pct)
+        if value is not None:
+            print(f"e2e latency p{pct}: {value:.2f}s wall, {value * args.speed:.1f}s at capture pace")
+    webhook_p95 = percentile(haptik.view_latencies, 95)
+    if webhook_p95 is not None:
+        print(f"webhook view latency p95: {webhook_p95 * 1000:.1f}ms")
+    print(f"redis commands={redis_calls} ({redis_calls / len(comments):.1f} per comment, all clients)")
+    print(f"reddit calls={dict(reddit.calls)}")
+    print(f"haptik calls={dict(haptik.calls)}")
+    if errors:
+        print(f"worker errors={dict(errors)}")
+
+
+if __name__ == "__main__":
+    main()
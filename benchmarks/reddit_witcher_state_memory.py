@@ -0,0 +1,120 @@
+"""
+Compares Redis memory used by the legacy Reddit Witcher keys and the namespaced state store
+
+Writes the same synthetic workload in both layouts under throwaway prefixes,
+sums MEMORY USAGE of every key and removes the keys again. Write time is not
+compared: the legacy layout is written through one pipeline and the state store
+call by call, so it would measure batching rather than the layout.
+
+Usage:
+    python reddit_witcher_state_memory.py --comments 10000 --replies 2
+"""
+from __future__ import absolute_import
+
+import argparse
+import json
+
+import django
+
+django.setup()
+
+from django_redis import get_redis_connection  # noqa: E402
+from integration.const import reddit_witcher as const  # noqa: E402
+from integration.utils.reddit_witcher_state import RedditWitcherState  # noqa: E402
+
+LEGACY_PREFIX = "reddit_witcher_bench_legacy:"
+BENCH_NAMESPACE = "reddit_witcher_bench"
+
+
+def synthetic_comments(count: int):
+    for i in range(count):
+        comment_id = f"c{i:07x}"
+        yield {
+            "id": comment_id,
+            "body": f"When does the next season of The Witcher come out? #{i}",
+            "author": f"redditor__{i}",
+            "message_id": 900000000 + i,
+        }
+
+
+def write_legacy(redis_client, comments, replies_per_comment: int):
+    reddit_comments = []
+    comment_ids = []
+    pipe = redis_client.pipeline(transaction=False)
+    for comment in comments:
+        reddit_comments.append({"id": comment["id"], "body": comment["body"], "author": comment["author"]})
+        comment_ids.append(comment["id"])
+        pipe.set(f"{LEGACY_PREFIX}{comment['message_id']}", comment["id"])
+        replies = [f"Reply {n} to {comment['id']}" for n in range(replies_per_comment)]
+        pipe.set(f"{LEGACY_PREFIX}{comment['id']}", json.dumps(replies))
+        pipe.set(f"{LEGACY_PREFIX}reddit_answered_comment_id_{comment['id']}", "yes", const.answered_comment_ttl)
+        pipe.set(f"{LEGACY_PREFIX}reddit_bot_break_comment_id_{comment['id']}", "yes", const.bot_break_comment_ttl)
+    pipe.set(f"{LEGACY_PREFIX}reddit_comments", json.dumps(reddit_comments))
+    pipe.set(f"{LEGACY_PREFIX}comment_ids", json.dumps(comment_ids))
+    pipe.execute()
+
+
+def write_state_store(state: RedditWitcherState, comments, replies_per_comment: int):
+    for comment in comments:
+        state.enqueue_comment({"id": comment["id"], "body": comment["body"], "author": comment["author"]})
+        state.map_message_to_comment(comment["message_id"], comment["id"])
+        for n in range(replies_per_comment):
+            state.add_reply(comment["id"], f"Reply {n} to {comment['id']}")
+        state.mark_answered(comment["id"])
+        state.mark_bot_break(comment["id"])
+
+
+def measure(redis_client, pattern: str):
+    """
+    :return: (number of keys, total bytes)
+    """
+    keys = list(redis_client.scan_iter(match=pattern, count=1000))
+    total = 0
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    for usage in pipe.execute():
+        total += usage or 0
+    return len(keys), total
+
+
+def cleanup(redis_client, pattern: str):
+    keys = list(redis_client.scan_iter(match=pattern, count=1000))
+    for i in range(0, len(keys), 1000):
+        redis_client.delete(*keys[i:i + 1000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--replies", type=int, default=1, help="replies per comment")
+    args = parser.parse_args()
+
+    redis_client = get_redis_connection('redis')
+    state = RedditWitcherState(redis_client=redis_client, namespace=BENCH_NAMESPACE)
+    legacy_pattern = f"{LEGACY_PREFIX}*"
+    state_pattern = f"{state.prefix}:*"
+
+    cleanup(redis_client, legacy_pattern)
+    cleanup(redis_client, state_pattern)
+    try:
+        write_legacy(redis_client, synthetic_comments(args.comments), args.replies)
+        legacy_keys, legacy_bytes = measure(redis_client, legacy_pattern)
+
+        write_state_store(state, synthetic_comments(args.comments), args.replies)
+        state_keys, state_bytes = measure(redis_client, state_pattern)
+    finally:
+        cleanup(redis_client, legacy_pattern)
+        cleanup(redis_client, state_pattern)
+
+    print(f"comments={args.comments} replies_per_comment={args.replies}")
+    print(f"{'layout':<12}{'keys':>10}{'bytes':>14}{'bytes/comment':>16}")
+    for name, keys, used in (
+        ("legacy", legacy_keys, legacy_bytes),
+        ("state", state_keys, state_bytes),
+    ):
+        print(f"{name:<12}{keys:>10}{used:>14}{used / max(args.comments, 1):>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
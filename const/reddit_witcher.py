@@ -16,4 +16,35 @@ secret_key = settings.REDDIT_WITCHER_SECRET_KEY
 user_agent = settings.REDDIT_WITCHER_USER_AGENT
 username = settings.REDDIT_WITCHER_USERNAME
 password = settings.REDDIT_WITCHER_PASSWORD
-submission_id = settings.REDDIT_WITCHER_SUBMISION_ID
\ No newline at end of file
+submission_id = settings.REDDIT_WITCHER_SUBMISION_ID
+
+# Redis state store
+redis_namespace = "reddit_witcher"
+redis_state_version = "v1"
+answered_comment_ttl = 1800  # 30 min
+bot_break_comment_ttl = 2592000  # 1 month
+message_mapping_ttl = 259200  # 3 days
+state_ttl = 2592000  # 1 month
+
+# Lease locks
+crawl_lock_ttl = 300  # 5 min, renewed while crawling
+send_replies_lock_ttl = 300  # 5 min, renewed while replying
+
+# Comment crawl
+crawl_more_comments_budget = 20  # MoreComments expansions (API calls) per run
+crawl_cold_branch_after = 21600  # 6 hours without new comments
+crawl_cold_branch_recheck = 86400  # expand cold branches once a day
+
+# Resilience
+haptik_timeout = 5  # seconds per request
+haptik_retry_attempts = 3
+haptik_call_deadline = 15  # seconds across all attempts of one call
+reddit_timeout = 10  # seconds per request, prawcore retries server errors itself
+retry_base_delay = 0.5
+retry_max_delay = 4
+circuit_failure_threshold = 5
+circuit_reset_timeout = 60  # seconds an open circuit rejects calls
+
+# Traffic capture, disabled unless a path is configured
+capture_path = getattr(settings, "REDDIT_WITCHER_CAPTURE_PATH", None)
+capture_salt = getattr(settings, "SECRET_KEY", "")
@@ -0,0 +1,20 @@
+"""
+One time migration of the legacy Reddit Witcher Redis keys into the state store
+
+Run once after deploying the state store, before the first crawl
+"""
+from __future__ import absolute_import
+
+import django
+import structlog
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+django.setup()
+logger = structlog.getLogger('utils')
+
+try:
+    logger.info("State migration started", usecase="State Migration", bot_name="Reddit Witcher")
+    migrated = RedditWitcherState().migrate_legacy_keys()
+    logger.info(usecase="State Migration", migrated=migrated, bot_name="Reddit Witcher")
+except Exception as e:
+    logger.exception(f"[REDDIT_WITCHER] [StateMigration] Migration failed: {e}")
@@ -0,0 +1,23 @@
+"""
+Removes expired and orphaned Reddit Witcher state from Redis
+"""
+from __future__ import absolute_import
+
+import django
+import structlog
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+django.setup()
+cron_logger = structlog.getLogger('cron')
+logger = structlog.getLogger('utils')
+
+try:
+    logger.info("State garbage collection started", usecase="State GC", bot_name="Reddit Witcher")
+    removed = RedditWitcherState().collect_garbage()
+    message = "Success"
+    logger.info(usecase="State GC", removed=removed, bot_name="Reddit Witcher")
+except Exception as e:
+    logger.exception(f"[REDDIT_WITCHER] [StateGC] Cron Job Failure: {e}")
+    message = "Failure, exception: " + str(e)
+
+cron_logger.info(message, job_name="reddit_witcher_state_gc_cron", bot_name="Reddit Witcher")
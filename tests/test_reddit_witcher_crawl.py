@@ -0,0 +1,169 @@
+import time
+
+import fakeredis
+from django.test import SimpleTestCase
+from integration.utils.reddit_witcher_crawl import MoreCommentsPlanner
+from integration.utils.reddit_witcher_state import RedditWitcherState
+from praw.models import MoreComments
+
+DAY = 86400
+
+
+def make_state():
+    redis_client = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    return RedditWitcherState(redis_client=redis_client, namespace="test")
+
+
+class FakeComment:
+    def __init__(self, comment_id, parent_id, created_utc=None, replies=()):
+        self.id = comment_id
+        self.fullname = f"t1_{comment_id}"
+        self.parent_id = parent_id
+        self.created_utc = created_utc if created_utc is not None else time.time()
+        self.replies = list(replies)
+
+
+class FakeStub(MoreComments):
+    """
+    MoreComments stub whose expansion returns the given items and counts the API calls
+    """
+
+    def __init__(self, parent_id, count, items=()):
+        super().__init__(None, {"id": f"more_{parent_id}_{count}", "parent_id": parent_id, "count": count,
+                                "children": []})
+        self.items = list(items)
+        self.calls = 0
+
+    def comments(self, update=True):
+        self.calls += 1
+        return self.items
+
+
+class FakeSubmission:
+    def __init__(self, comments):
+        self.fullname = "t3_sub"
+        self.created_utc = time.time() - 7 * DAY
+        self.comments = comments
+
+
+class MoreCommentsPlannerTests(SimpleTestCase):
+    COLD_AFTER = 6 * 3600
+    COLD_RECHECK = DAY
+
+    def setUp(self):
+        self.state = make_state()
+        self.now = time.time()
+
+    def planner(self, budget=20):
+        return MoreCommentsPlanner(self.state, budget=budget, cold_after=self.COLD_AFTER,
+                                   cold_recheck=self.COLD_RECHECK)
+
+    def remember_cold_branch(self, parent_id, hidden, expanded_ago):
+        self.state.save_crawl_branches({parent_id: {
+            "latest": self.now - 2 * DAY, "hidden": hidden, "expanded_at": self.now - expanded_ago,
+        }})
+
+    def thread_with_stub(self, stub):
+        parent = FakeComment("a", "t3_sub", created_utc=self.now - 3 * DAY, replies=[stub])
+        return parent, FakeSubmission([parent])
+
+    def test_budget_caps_expansions(self):
+        stubs = [FakeStub(f"t1_p{n}", 5) for n in range(5)]
+        parents = [FakeComment(f"p{n}", "t3_sub", replies=[stub]) for n, stub in enumerate(stubs)]
+
+        crawl = self.planner(budget=2).expand(FakeSubmission(parents))
+
+        self.assertEqual(sum(stub.calls for stub in stubs), 2)
+        self.assertEqual((crawl.stats["expanded"], crawl.stats["remaining"]), (2, 3))
+
+    def test_should_stop_ends_expansion(self):
+        stub = FakeStub("t1_a", 5)
+        _, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner().expand(submission, should_stop=lambda: True)
+
+        self.assertEqual(stub.calls, 0)
+        self.assertEqual(crawl.stats["remaining"], 1)
+
+    def test_cold_branch_skipped(self):
+        stub = FakeStub("t1_a", 3)
+        self.remember_cold_branch("t1_a", hidden=3, expanded_ago=3600)
+        _, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner().expand(submission)
+
+        self.assertEqual(stub.calls, 0)
+        self.assertEqual(crawl.stats["skipped_cold"], 1)
+
+    def test_cold_branch_rechecked_after_cold_recheck(self):
+        stub = FakeStub("t1_a", 3)
+        self.remember_cold_branch("t1_a", hidden=3, expanded_ago=self.COLD_RECHECK + 60)
+        _, submission = self.thread_with_stub(stub)
+
+        self.planner().expand(submission)
+
+        self.assertEqual(stub.calls, 1)
+        self.assertGreaterEqual(self.state.get_crawl_branches(["t1_a"])["t1_a"]["expanded_at"], self.now)
+
+    def test_growing_stub_uncolds_branch(self):
+        stub = FakeStub("t1_a", 5)
+        self.remember_cold_branch("t1_a", hidden=3, expanded_ago=3600)
+        _, submission = self.thread_with_stub(stub)
+
+        self.planner().expand(submission)
+
+        self.assertEqual(stub.calls, 1)
+        self.assertEqual(self.state.get_crawl_branches(["t1_a"])["t1_a"]["hidden"], 5)
+
+    def test_remainder_stubs_of_expanded_parent_not_skipped(self):
+        remainder = FakeStub("t1_a", 40, [FakeComment("r2", "t1_a", created_utc=self.now - 3 * DAY)])
+        stub = FakeStub("t1_a", 140, [FakeComment("r1", "t1_a", created_utc=self.now - 3 * DAY), remainder])
+        self.remember_cold_branch("t1_a", hidden=100, expanded_ago=3600)
+        parent, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner().expand(submission)
+
+        self.assertEqual((stub.calls, remainder.calls), (1, 1))
+        self.assertEqual([reply.id for reply in crawl.replies(parent)], ["r1", "r2"])
+        self.assertTrue(crawl.has_all_replies(parent))
+
+    def test_remainder_stub_does_not_overwrite_hidden_count(self):
+        remainder = FakeStub("t1_a", 40)
+        stub = FakeStub("t1_a", 140, [remainder])
+        _, submission = self.thread_with_stub(stub)
+
+        self.planner().expand(submission)
+
+        self.assertEqual(self.state.get_crawl_branches(["t1_a"])["t1_a"]["hidden"], 140)
+
+    def test_parent_with_cold_stub_has_not_all_replies(self):
+        # The crawl skips such comments until the branch is rechecked, up to cold_recheck later
+        stub = FakeStub("t1_a", 3)
+        self.remember_cold_branch("t1_a", hidden=3, expanded_ago=3600)
+        parent, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner().expand(submission)
+
+        self.assertIn(parent, crawl.comments)
+        self.assertFalse(crawl.has_all_replies(parent))
+
+    def test_parent_with_stub_over_budget_has_not_all_replies(self):
+        stub = FakeStub("t1_a", 3)
+        parent, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner(budget=0).expand(submission)
+
+        self.assertFalse(crawl.has_all_replies(parent))
+
+    def test_expanded_comments_keep_their_replies(self):
+        # morechildren returns the expanded comments as a flat list with empty .replies
+        bot_reply = FakeComment("bot", "t1_c")
+        child = FakeComment("c", "t1_a")
+        stub = FakeStub("t1_a", 1, [child, bot_reply])
+        parent, submission = self.thread_with_stub(stub)
+
+        crawl = self.planner().expand(submission)
+
+        self.assertEqual(crawl.replies(child), [bot_reply])
+        self.assertTrue(crawl.has_all_replies(parent))
+        self.assertTrue(crawl.has_all_replies(child))
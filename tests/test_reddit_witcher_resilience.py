@@ -0,0 +1,339 @@
+"""
+Fault injection tests for the Reddit Witcher retry, circuit breaker and requeue paths
+
+Haptik is a local stub HTTP server answering from a script, Reddit is a fake
+praw client and Redis is fakeredis (with lupa for the Lua scripts).
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import fakeredis
+import prawcore
+import requests
+import urllib3
+from django.test import SimpleTestCase, override_settings
+from integration.const import reddit_witcher as const
+from integration.utils import reddit_witcher
+from integration.utils.reddit_witcher_resilience import CircuitBreaker, CircuitOpen, RequestOutcomeUnknown, \
+    ServiceUnavailable, call_with_retry
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+COMMENT = {"id": "c1", "body": "When is season 3?", "author": "geralt"}
+
+
+def make_state():
+    redis_client = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    return RedditWitcherState(redis_client=redis_client, namespace="test")
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubHaptikServer:
+    """
+    Answers every request with the next scripted (delay, status, body) for its path,
+    repeating the last one when the script runs out
+    """
+
+    def __init__(self, scripts: dict):
+        self.scripts = {path: list(script) for path, script in scripts.items()}
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}{path}"
+
+    def count(self, path):
+        return self.requests.count(path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests.append(self.path)
+                script = stub.scripts[self.path]
+                delay, status, body = script.pop(0) if len(script) > 1 else script[0]
+                time.sleep(delay)
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@mock.patch("integration.utils.reddit_witcher_resilience.random.uniform", return_value=0)
+class CallWithRetryTests(SimpleTestCase):
+    def test_retries_service_unavailable_until_success(self, _):
+        func = mock.Mock(side_effect=[ServiceUnavailable(), ServiceUnavailable(), "ok"])
+        self.assertEqual(call_with_retry(func, attempts=3), "ok")
+        self.assertEqual(func.call_count, 3)
+
+    def test_raises_after_last_attempt(self, _):
+        func = mock.Mock(side_effect=ServiceUnavailable())
+        with self.assertRaises(ServiceUnavailable):
+            call_with_retry(func, attempts=3)
+        self.assertEqual(func.call_count, 3)
+
+    def test_does_not_retry_other_errors(self, _):
+        func = mock.Mock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            call_with_retry(func, attempts=3)
+        self.assertEqual(func.call_count, 1)
+
+    def test_request_outcome_unknown_is_not_retried_but_opens_circuit(self, _):
+        breaker = CircuitBreaker("test", make_state(), failure_threshold=1)
+        func = mock.Mock(side_effect=RequestOutcomeUnknown())
+        with self.assertRaises(RequestOutcomeUnknown):
+            call_with_retry(func, breaker=breaker, attempts=3)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(breaker.allow())
+
+    def test_stops_retrying_at_deadline(self, uniform):
+        uniform.return_value = 1
+        func = mock.Mock(side_effect=ServiceUnavailable())
+        with self.assertRaises(ServiceUnavailable):
+            call_with_retry(func, attempts=5, deadline=0.5)
+        self.assertEqual(func.call_count, 1)
+
+    def test_open_circuit_rejects_call(self, _):
+        breaker = CircuitBreaker("test", make_state(), failure_threshold=1)
+        breaker.record_failure()
+        func = mock.Mock()
+        with self.assertRaises(CircuitOpen):
+            call_with_retry(func, breaker=breaker)
+        func.assert_not_called()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("test", make_state(), failure_threshold=3, reset_timeout=0.1)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_success_on_closed_circuit_writes_nothing(self):
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.redis.exists(self.breaker.key))
+
+    def test_circuit_state_expires(self):
+        self.breaker.record_failure()
+        self.assertGreater(self.breaker.redis.ttl(self.breaker.key), 0)
+        self.breaker.record_success()
+        self.assertGreater(self.breaker.redis.ttl(self.breaker.key), 0)
+
+    def test_half_open_failure_reopens(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        time.sleep(0.15)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_success_closes(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        time.sleep(0.15)
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(HAPTIK_ENV="staging")
+@mock.patch("integration.utils.reddit_witcher_resilience.random.uniform", return_value=0)
+@mock.patch.object(const, "haptik_timeout", 0.2)
+class HaptikFaultInjectionTests(SimpleTestCase):
+    USER_PATH = "/v1.0/user/"
+    SEND_PATH = "/v1.0/log_message_from_user/"
+
+    def start_haptik(self, send_script, user_script=((0, 200, {}),)):
+        stub = StubHaptikServer({self.USER_PATH: user_script, self.SEND_PATH: send_script})
+        self.addCleanup(stub.close)
+        self.use_urls(stub.url(self.USER_PATH), stub.url(self.SEND_PATH))
+        return stub
+
+    def use_urls(self, user_url, send_url):
+        for name, url in (("haptik_preprod_create_user_url", user_url), ("haptik_preprod_send_msg_url", send_url)):
+            patcher = mock.patch.object(const, name, url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_service(self, *comments):
+        state = make_state()
+        service = reddit_witcher.RedditToHaptikAdapter.HaptikService(reddit=mock.Mock(), state=state)
+        for comment in comments:
+            state.enqueue_comment(comment)
+        return service, state
+
+    def test_503_is_retried_and_message_mapped(self, _):
+        stub = self.start_haptik([(0, 503, {}), (0, 200, {"message_id": 7})])
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(stub.count(self.SEND_PATH), 2)
+        self.assertEqual(state.get_comment_for_message(7), "c1")
+        self.assertEqual(state.get_queued_comments(), [])
+
+    def test_429_is_retried(self, _):
+        stub = self.start_haptik([(0, 429, {}), (0, 200, {"message_id": 7})])
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(stub.count(self.SEND_PATH), 2)
+        self.assertEqual(state.get_comment_for_message(7), "c1")
+
+    def test_comment_requeued_when_haptik_keeps_failing(self, _):
+        stub = self.start_haptik([(0, 503, {})])
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(stub.count(self.SEND_PATH), const.haptik_retry_attempts)
+        self.assertEqual(state.get_queued_comments(), [COMMENT])
+
+    def test_read_timeout_on_send_message_drops_comment_without_resending(self, _):
+        stub = self.start_haptik([(0.5, 200, {"message_id": 7})])
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(stub.count(self.SEND_PATH), 1)
+        self.assertEqual(state.get_queued_comments(), [])
+        self.assertIsNone(state.get_comment_for_message(7))
+
+    def test_500_on_send_message_is_not_retried(self, _):
+        stub = self.start_haptik([(0, 500, {})])
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(stub.count(self.SEND_PATH), 1)
+        self.assertEqual(state.get_queued_comments(), [])
+
+    def test_connection_refused_requeues_comment(self, _):
+        port = closed_port()
+        self.use_urls(f"http://127.0.0.1:{port}{self.USER_PATH}", f"http://127.0.0.1:{port}{self.SEND_PATH}")
+        service, state = self.make_service(COMMENT)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(state.get_queued_comments(), [COMMENT])
+
+    def test_open_circuit_leaves_rest_of_queue(self, _):
+        stub = self.start_haptik([(0, 503, {})], user_script=[(0, 503, {})])
+        other = dict(COMMENT, id="c2")
+        service, state = self.make_service(COMMENT, other)
+        service.haptik_breaker = CircuitBreaker("haptik", state, failure_threshold=1)
+
+        service.send_comments_to_haptik()
+
+        self.assertEqual(len(stub.requests), 1)
+        self.assertCountEqual(state.get_queued_comments(), [COMMENT, other])
+
+
+class RedditFaultInjectionTests(SimpleTestCase):
+    def setUp(self):
+        self.state = make_state()
+        self.comment = mock.Mock(banned_by=None, body="When is season 3?")
+        reddit = mock.Mock()
+        reddit.comment.return_value = self.comment
+        self.service = reddit_witcher.HaptikToRedditAdapter.RedditService(reddit=reddit, state=self.state)
+        self.state.add_reply("c1", "Next year")
+
+    def send_replies(self):
+        reddit_witcher.HaptikToRedditAdapter.HaptikToRedditService(
+            payload={}, reddit_service=self.service
+        ).worker_v2()
+
+    def assert_requeued(self):
+        self.assertEqual(self.state.get_pending_reply_comment_ids(), ["c1"])
+        self.assertEqual(self.state.get_replies("c1"), ["Next year"])
+        self.assertFalse(self.state.is_answered("c1"))
+
+    def assert_dropped(self):
+        self.assertEqual(self.state.get_pending_reply_comment_ids(), [])
+        self.assertEqual(self.state.get_replies("c1"), [])
+
+    def test_reply_posted(self):
+        self.send_replies()
+
+        self.comment.reply.assert_called_once_with("Next year")
+        self.assertTrue(self.state.is_answered("c1"))
+        self.assert_dropped()
+
+    def test_connect_error_requeues_reply(self):
+        connect_error = requests.exceptions.ConnectionError(urllib3.exceptions.NewConnectionError(None, "refused"))
+        self.comment.reply.side_effect = prawcore.exceptions.RequestException(connect_error, (), {})
+
+        self.send_replies()
+
+        self.assert_requeued()
+
+    def test_read_timeout_drops_reply(self):
+        self.comment.reply.side_effect = prawcore.exceptions.RequestException(
+            requests.exceptions.ReadTimeout(), (), {}
+        )
+
+        self.send_replies()
+
+        self.comment.reply.assert_called_once()
+        self.assert_dropped()
+
+    def test_503_requeues_reply(self):
+        self.comment.reply.side_effect = prawcore.exceptions.ResponseException(mock.Mock(status_code=503))
+
+        self.send_replies()
+
+        self.assert_requeued()
+
+    def test_500_drops_reply(self):
+        self.comment.reply.side_effect = prawcore.exceptions.ResponseException(mock.Mock(status_code=500))
+
+        self.send_replies()
+
+        self.assert_dropped()
+
+    def test_open_circuit_requeues_without_calling_reddit(self):
+        self.service.reddit_breaker = CircuitBreaker("reddit", self.state, failure_threshold=1)
+        self.service.reddit_breaker.record_failure()
+
+        self.send_replies()
+
+        self.comment.reply.assert_not_called()
+        self.assert_requeued()
@@ -0,0 +1,90 @@
+import json
+
+import fakeredis
+from django.test import SimpleTestCase
+from integration.utils.reddit_witcher_lock import LeaseLock
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+
+def make_state():
+    redis_client = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    return RedditWitcherState(redis_client=redis_client, namespace="test")
+
+
+class MigrateLegacyKeysTests(SimpleTestCase):
+    def setUp(self):
+        self.state = make_state()
+        self.redis = self.state.redis
+
+    def test_flags_keep_remaining_ttl(self):
+        self.redis.set("reddit_answered_comment_id_c1", "yes", ex=60)
+        self.redis.set("reddit_bot_break_comment_id_c2", "yes")
+
+        migrated = self.state.migrate_legacy_keys()
+
+        self.assertEqual((migrated["answered"], migrated["bot_break"]), (1, 1))
+        self.assertTrue(self.state.is_answered("c1"))
+        self.assertTrue(self.state.is_bot_break("c2"))
+        self.assertFalse(self.redis.exists("reddit_answered_comment_id_c1", "reddit_bot_break_comment_id_c2"))
+
+    def test_bare_message_ids_are_moved(self):
+        self.redis.set("1234567", "h7x2k9a")
+
+        migrated = self.state.migrate_legacy_keys()
+
+        self.assertEqual(migrated["messages"], 1)
+        self.assertEqual(self.state.get_comment_for_message(1234567), "h7x2k9a")
+        self.assertIsNotNone(self.redis.zscore(self.state.key(self.state.MESSAGES_INDEX), "1234567"))
+        self.assertFalse(self.redis.exists("1234567"))
+
+    def test_listed_replies_are_moved_and_orphaned_ones_expire(self):
+        self.redis.set("comment_ids", json.dumps(["h7x2k9a"]))
+        self.redis.set("h7x2k9a", json.dumps(["Toss a coin"]))
+        self.redis.set("h7x2k9b", json.dumps(["Never posted"]))
+
+        migrated = self.state.migrate_legacy_keys()
+
+        self.assertEqual((migrated["replies"], migrated["expired_replies"]), (1, 1))
+        self.assertEqual(self.state.get_replies("h7x2k9a"), ["Toss a coin"])
+        self.assertEqual(self.state.get_pending_reply_comment_ids(), ["h7x2k9a"])
+        self.assertEqual(self.state.get_replies("h7x2k9b"), [])
+        self.assertGreater(self.redis.ttl("h7x2k9b"), 0)
+
+    def test_keys_of_other_shapes_are_left_alone(self):
+        self.redis.set("1234567", "not a comment id")
+        self.redis.set("42", "h7x2k9a", ex=60)
+        self.redis.set("h7x2k9c", "plain text")
+        self.redis.hset("98765", "field", "value")
+
+        self.state.migrate_legacy_keys()
+
+        self.assertEqual(self.redis.get("1234567"), "not a comment id")
+        self.assertEqual(self.redis.get("42"), "h7x2k9a")
+        self.assertEqual(self.redis.ttl("h7x2k9c"), -1)
+        self.assertEqual(self.redis.hget("98765", "field"), "value")
+        self.assertIsNone(self.state.get_comment_for_message(42))
+
+
+class CollectOrphanedRepliesTests(SimpleTestCase):
+    def setUp(self):
+        self.state = make_state()
+        self.state.add_reply("c1", "Toss a coin")
+        self.state.add_reply("c2", "Next year")
+        self.state.claim_pending_reply("c1")
+
+    def test_replies_of_claimed_comments_kept_while_replies_are_sent(self):
+        lock = LeaseLock("send_replies", ttl=60, state=self.state)
+        self.assertTrue(lock.acquire())
+
+        removed = self.state.collect_garbage()
+
+        self.assertEqual(removed["orphaned_replies"], 0)
+        self.assertEqual(self.state.get_replies("c1"), ["Toss a coin"])
+
+    def test_replies_of_comments_not_pending_collected(self):
+        removed = self.state.collect_garbage()
+
+        self.assertEqual(removed["orphaned_replies"], 1)
+        self.assertEqual(self.state.get_replies("c1"), [])
+        self.assertEqual(self.state.get_replies("c2"), ["Next year"])
+        self.assertTrue(LeaseLock("send_replies", ttl=60, state=self.state).acquire())
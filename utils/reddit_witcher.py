@@ -1,32 +1,38 @@
 import datetime
-import json
+import time
 
 import api.requests.methods as api_requests
 import praw
 import praw.reddit
+import prawcore
+import requests
 import structlog
-from django_redis import get_redis_connection
 from integration.const import reddit_witcher as const
-
-redis_cache = get_redis_connection('redis')
-redis_cache.connection_pool.connection_kwargs["decode_responses"] = True
-redis_cache.connection_pool.reset()
+from integration.utils.reddit_witcher_capture import recorder
+from integration.utils.reddit_witcher_crawl import MoreCommentsPlanner
+from integration.utils.reddit_witcher_lock import LeaseLock
+from integration.utils.reddit_witcher_resilience import CircuitBreaker, CircuitOpen, RequestOutcomeUnknown, \
+    ServiceUnavailable, call_with_retry, is_connect_error
+from integration.utils.reddit_witcher_state import RedditWitcherState
 
 logger = structlog.getLogger("utils")
 
 
 class RedditToHaptikAdapter:
     class HaptikService:
-        def __init__(self):
+        def __init__(self, reddit=None, state=None):
             """
             Initializing/Login reddit account
+            :param reddit: praw.Reddit, logged in from settings when not given
+            :param state: RedditWitcherState
             """
-            self.r = praw.Reddit(
+            self.r = reddit if reddit is not None else praw.Reddit(
                 client_id=const.client_id,
                 client_secret=const.secret_key,
                 user_agent=const.user_agent,
                 username=const.username,
-                password=const.password
+                password=const.password,
+                timeout=const.reddit_timeout
             )
 
             self.bot_id = ""
@@ -38,6 +44,47 @@ class RedditToHaptikAdapter:
                 "client-id": const.haptik_client_id,
                 "Authorization": const.haptik_authorization
             }
+            self.state = state if state is not None else RedditWitcherState()
+            self.haptik_breaker = CircuitBreaker("haptik", state=self.state)
+
+        def post_to_haptik(self, url, payload, idempotent=False):
+            """
+            POST to Haptik with a timeout, jittered retries and the shared circuit breaker
+
+            Connect errors, 429 and 503 responses are retried. Read timeouts and other
+            5xx responses are only retried for idempotent requests, otherwise Haptik
+            may already have logged the message. Other responses are returned as they are
+            :param url: str
+            :param payload: Dict
+            :param idempotent: bool, True if sending the request twice is harmless
+            :return: response
+            :raises ServiceUnavailable: if Haptik is still failing after all attempts
+            :raises RequestOutcomeUnknown: if a non idempotent request failed after it was sent
+            """
+            def post():
+                try:
+                    response = api_requests.post(
+                        url,
+                        json=payload,
+                        headers=self.HEADERS,
+                        timeout=const.haptik_timeout
+                    )
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if idempotent or is_connect_error(e):
+                        raise ServiceUnavailable(f"Haptik request failed: {e}") from e
+                    raise RequestOutcomeUnknown(f"Haptik request failed after it was sent: {e}") from e
+                if response.status_code in (429, 503) or (idempotent and response.status_code >= 500):
+                    raise ServiceUnavailable(f"Haptik responded with status {response.status_code}")
+                if response.status_code >= 500:
+                    raise RequestOutcomeUnknown(f"Haptik responded with status {response.status_code}")
+                return response
+
+            return call_with_retry(
+                post,
+                breaker=self.haptik_breaker,
+                attempts=const.haptik_retry_attempts,
+                deadline=const.haptik_call_deadline
+            )
 
         def create_user(self, payload):
             """
@@ -52,12 +99,8 @@ class RedditToHaptikAdapter:
                 create_user_url = const.haptik_create_user_url
             else:
                 create_user_url = const.haptik_preprod_create_user_url
-            response = api_requests.post(
-                create_user_url,
-                json=payload,
-                headers=self.HEADERS,
-                timeout=5
-            )
+            # Creating the same auth_id twice is harmless
+            response = self.post_to_haptik(create_user_url, payload, idempotent=True)
             logger.info(
                 usecase="Create User",
                 class_name="RedditToHaptikAdapter",
@@ -84,15 +127,11 @@ class RedditToHaptikAdapter:
                 send_msg_url = const.haptik_send_msg_url
             else:
                 send_msg_url = const.haptik_preprod_send_msg_url
-            response = api_requests.post(
-                send_msg_url,
-                json=payload,
-                headers=self.HEADERS
-            )
+            response = self.post_to_haptik(send_msg_url, payload)
             logger.info(
                 usecase="Send Message",
                 class_name="RedditToHaptikAdapter",
-                response=str(response.json()),
+                response=response.text,
                 bot_name="Reddit Witcher"
             )
             return response
@@ -131,8 +170,7 @@ class RedditToHaptikAdapter:
                 "business_id": const.business_id
             }
 
-        @staticmethod
-        def get_reddit_comments_from_redis():
+        def get_reddit_comments_from_redis(self):
             """
             Get comments stored in redis cache
             :return: List of comment object
@@ -143,8 +181,9 @@ class RedditToHaptikAdapter:
                 "author": str
             }
             """
+            reddit_comments = []
             try:
-                reddit_comments = redis_cache.get("reddit_comments")
+                reddit_comments = self.state.get_queued_comments()
                 logger.info(
                     usecase="Get Comments",
                     class_name="RedditToHaptikAdapter",
@@ -154,13 +193,9 @@ class RedditToHaptikAdapter:
             except Exception as e:
                 logger.info(
                     usecase="Get Comments", class_name="RedditToHaptikAdapter", exception=e, bot_name="Reddit Witcher")
-            if reddit_comments:
-                reddit_comments = json.loads(reddit_comments)
-            else:
-                reddit_comments = []
             return reddit_comments
 
-        def validate_comment(self, comment):
+        def validate_comment(self, comment, replies=None):
             """
             Checks if comment can be replied or not.
 
@@ -172,14 +207,14 @@ class RedditToHaptikAdapter:
 
             This checks will be done using ids stored in redis cache
             :param comment:
+            :param replies: List of replies of the comment, defaults to comment.replies
             :return: bool
             """
             from praw.models import MoreComments
             if isinstance(comment, MoreComments):
                 return False
 
-            redis_key_for_answered_comment = f"reddit_answered_comment_id_{comment.id}"
-            if is_redis_key_already_exists(redis_key_for_answered_comment):
+            if self.state.is_answered(comment.id):
                 logger.info(
                     "Already Replied not sending to Haptik",
                     usecase="Validate Comment",
@@ -189,8 +224,7 @@ class RedditToHaptikAdapter:
                 )
                 return False
 
-            redis_key_for_bot_break_comment = f"reddit_bot_break_comment_id_{comment.id}"
-            if is_redis_key_already_exists(redis_key_for_bot_break_comment):
+            if self.state.is_bot_break(comment.id):
                 logger.info(
                     "Bot break comment not sending to Haptik",
                     usecase="Validate Comment",
@@ -213,7 +247,8 @@ class RedditToHaptikAdapter:
 
             is_comment_removed = comment.banned_by is True or \
                 comment.body == "[removed]" or comment.body == '[deleted]'
-            has_replied = self.bot_name in [str(re.author) for re in comment.replies if comment.author]
+            replies = comment.replies if replies is None else replies
+            has_replied = self.bot_name in [str(re.author) for re in replies if comment.author]
             if is_comment_removed or has_replied:
                 logger.info(
                     "Comment is removed by moderator or Replied already",
@@ -225,12 +260,12 @@ class RedditToHaptikAdapter:
                 return False
             return True
 
-        def get_all_comments_without_stream(self, submission_id: str):
+        def get_all_comments_without_stream(self, submission_id: str, lock: LeaseLock = None):
             """
             Get all comments from submission/post and sends the comment to Haptik if it is can be replied
 
 
-            Get comments
+            Get comments, expanding the most active MoreComments stubs within the crawl budget
                 Check comment can be replied or not
                 store it in redis cache
 
@@ -239,78 +274,131 @@ class RedditToHaptikAdapter:
             Update redis cache
 
             :param submission_id: str
+            :param lock: LeaseLock held for the crawl, renewed before every expansion
             :return: none
             """
             logger.info(usecase="Get Comments", class_name="RedditToHaptikAdapter", bot_name="Reddit Witcher")
 
-            epoch = datetime.datetime.fromtimestamp(self.r.auth.limits["reset_timestamp"])
-            duration = (epoch - datetime.datetime.now()).total_seconds()
-            if self.check_rate_limit(duration):
+            if self.is_rate_limited():
                 return
 
+            def should_stop():
+                if lock:
+                    lock.ensure_held()
+                return self.is_rate_limited()
+
             submission = self.r.submission(submission_id)
             submission.comment_sort = "new"
-            submission.comments.replace_more(limit=None)
-
-            comments = submission.comments.list()
+            crawl = MoreCommentsPlanner(self.state, lock=lock).expand(submission, should_stop=should_stop)
             logger.info(
                 usecase="Get Comments",
                 class_name="RedditToHaptikAdapter",
-                comments=comments,
+                comments=crawl.comments,
                 bot_name="Reddit Witcher"
             )
-            reddit_comments = self.get_reddit_comments_from_redis()
-            while comments:
-                for comment in comments:
-                    can_be_replied = self.validate_comment(comment=comment)
-                    if can_be_replied:
-                        comment_dict = {
-                            "id": str(comment.id),
-                            "body": str(comment.body),
-                            "author": str(comment.author).replace('-', '__')
-                        }
-                        if comment_dict not in reddit_comments:
-                            reddit_comments.append(comment_dict)
-                            redis_cache.set("reddit_comments", json.dumps(reddit_comments))
-
-                epoch = datetime.datetime.fromtimestamp(self.r.auth.limits["reset_timestamp"])
-                duration = (epoch - datetime.datetime.now()).total_seconds()
-                if self.check_rate_limit(duration):
-                    return
-                comments = []
-                if submission.comments.replace_more():
-                    comments = submission.comments.list()
+
+            if lock:
+                lock.ensure_held()
+            for comment in crawl.comments:
+                if not crawl.has_all_replies(comment):
+                    # A bot reply may be hidden behind the stub, wait until it is expanded
                     logger.info(
-                        usecase="Get Comments",
+                        "Replies not fully loaded",
+                        usecase="Validate Comment",
                         class_name="RedditToHaptikAdapter",
-                        comments=comments,
+                        comment_id=comment.id,
                         bot_name="Reddit Witcher"
                     )
-
+                    continue
+                can_be_replied = self.validate_comment(comment=comment, replies=crawl.replies(comment))
+                if can_be_replied:
+                    comment_dict = {
+                        "id": str(comment.id),
+                        "body": str(comment.body),
+                        "author": str(comment.author).replace('-', '__')
+                    }
+                    if self.state.enqueue_comment(comment_dict, lock=lock):
+                        recorder.record_comment(comment_dict, created_utc=comment.created_utc)
+
+            self.send_comments_to_haptik(lock=lock)
+
+        def send_comments_to_haptik(self, lock: LeaseLock = None):
+            """
+            Sends queued comments to Haptik
+
+            Every comment is claimed from the queue before it is sent, so overlapping
+            runs split the queue between them instead of sending a comment twice.
+            Comments are put back in the queue when Haptik is unavailable, and the
+            rest of the queue is left for the next run once the circuit opens.
+            :param lock: LeaseLock held for the crawl, renewed before every comment
+            :return: none
+            """
             reddit_comments = self.get_reddit_comments_from_redis()
-            while reddit_comments:
-                comment = reddit_comments.pop(0)
-                logger.info(
-                    "Processing Comment", usecase="Get Comments",
-                    class_name="RedditToHaptikAdapter", comment_id=comment["id"]
-                )
-                user_payload = self.get_create_user_payload(comment["author"] + comment["id"])
-                self.create_user(user_payload)
+            for comment in reddit_comments:
+                if lock:
+                    lock.ensure_held()
+                if not self.state.claim_comment(comment["id"], lock=lock):
+                    continue
+                try:
+                    self.send_comment_to_haptik(comment)
+                except ServiceUnavailable as e:
+                    self.state.requeue_comment(comment)
+                    logger.exception("[REDDIT_WITCHER] [RedditToHaptikAdapter] Haptik unavailable, comment requeued",
+                                     comment_id=comment["id"], exception=e)
+                    if isinstance(e, CircuitOpen):
+                        return
+                except RequestOutcomeUnknown as e:
+                    # Haptik may have logged the message, sending it again could reply twice
+                    logger.exception("[REDDIT_WITCHER] [RedditToHaptikAdapter] Haptik outcome unknown, comment dropped",
+                                     comment_id=comment["id"], exception=e)
+                except Exception as e:
+                    logger.exception("[REDDIT_WITCHER] [RedditToHaptikAdapter] Unable to send comment to Haptik",
+                                     comment_id=comment["id"], exception=e)
 
-                logger.info(
-                    "Send Message", usecase="Get Comments", class_name="RedditToHaptikAdapter",
-                    author=comment["author"], comment_body=comment["body"], comment_id=comment["id"],
-                    bot_name="Reddit Witcher"
-                )
-                message_payload = self.get_send_message_payload(comment["author"] + comment["id"], comment["body"])
-                response = self.send_message(message_payload)
+        def send_comment_to_haptik(self, comment: dict):
+            """
+            Creates Haptik user for the comment author and sends the comment
 
-                # caching
-                message_response = response.json()
-                message_id = message_response.get("message_id")
-                redis_key = f"{message_id}"
-                redis_cache.set(redis_key, comment["id"])
-                redis_cache.set("reddit_comments", json.dumps(reddit_comments))
+            :param comment: comment object
+            :return: none
+            :raises ServiceUnavailable: if Haptik is unavailable
+            """
+            logger.info(
+                "Processing Comment", usecase="Get Comments",
+                class_name="RedditToHaptikAdapter", comment_id=comment["id"]
+            )
+            user_payload = self.get_create_user_payload(comment["author"] + comment["id"])
+            self.create_user(user_payload)
+
+            logger.info(
+                "Send Message", usecase="Get Comments", class_name="RedditToHaptikAdapter",
+                author=comment["author"], comment_body=comment["body"], comment_id=comment["id"],
+                bot_name="Reddit Witcher"
+            )
+            message_payload = self.get_send_message_payload(comment["author"] + comment["id"], comment["body"])
+            started = time.monotonic()
+            response = self.send_message(message_payload)
+            recorder.record_haptik_response(comment["id"], response, latency=time.monotonic() - started)
+
+            # caching
+            try:
+                message_id = response.json().get("message_id")
+            except ValueError:
+                message_id = None
+            if not message_id:
+                logger.error("[REDDIT_WITCHER] [RedditToHaptikAdapter] No message id in Haptik response",
+                             comment_id=comment["id"], status_code=response.status_code, response=response.text)
+                return
+            self.state.map_message_to_comment(message_id, comment["id"])
+
+        def is_rate_limited(self):
+            """
+            Checks rate limit using the reset time of the current window
+            :return: bool
+            """
+            epoch = datetime.datetime.fromtimestamp(self.r.auth.limits["reset_timestamp"])
+            duration = (epoch - datetime.datetime.now()).total_seconds()
+            return self.check_rate_limit(duration)
 
         def check_rate_limit(self, duration):
             """
@@ -333,9 +421,10 @@ class RedditToHaptikAdapter:
             return False
 
     class RedditToHaptikService:
-        def __init__(self, payload):
+        def __init__(self, payload, haptik_service=None):
             self.payload = payload
-            self.haptik_service = RedditToHaptikAdapter.HaptikService()
+            self.haptik_service = haptik_service if haptik_service is not None \
+                else RedditToHaptikAdapter.HaptikService()
 
         def worker(self):
             """
@@ -349,7 +438,22 @@ class RedditToHaptikAdapter:
                         class_name="RedditToHaptikAdapter",
                         bot_name="Reddit Witcher"
                     )
-                    self.haptik_service.get_all_comments_without_stream(submission_id=const.submission_id)
+                    lock = LeaseLock("crawl", ttl=const.crawl_lock_ttl, state=self.haptik_service.state)
+                    if lock.acquire():
+                        try:
+                            self.haptik_service.get_all_comments_without_stream(
+                                submission_id=const.submission_id, lock=lock
+                            )
+                        finally:
+                            lock.release()
+                    else:
+                        logger.info(
+                            "Crawl already running, only sending queued comments",
+                            usecase="Send Comments",
+                            class_name="RedditToHaptikAdapter",
+                            bot_name="Reddit Witcher"
+                        )
+                        self.haptik_service.send_comments_to_haptik()
                     logger.info(
                         usecase="Send Comments",
                         event_name="Bot Stop",
@@ -361,32 +465,76 @@ class RedditToHaptikAdapter:
 
 class HaptikToRedditAdapter:
     class RedditService:
-        def __init__(self):
-            self.r = praw.Reddit(
+        def __init__(self, reddit=None, state=None):
+            """
+            :param reddit: praw.Reddit, logged in from settings when not given
+            :param state: RedditWitcherState
+            """
+            self.r = reddit if reddit is not None else praw.Reddit(
                 client_id=const.client_id,
                 client_secret=const.secret_key,
                 user_agent=const.user_agent,
                 username=const.username,
-                password=const.password
+                password=const.password,
+                timeout=const.reddit_timeout
             )
+            self.state = state if state is not None else RedditWitcherState()
+            self.reddit_breaker = CircuitBreaker("reddit", state=self.state)
 
         def reply_to_comment(self, comment_id: str, msg: str):
             """
             Reply to a comment
 
-            Checks if comment is removed or deleted
+            Checks if comment is removed or deleted.
+            Failures that happened before the reply was posted (any failure while
+            fetching the comment, connect errors, 429, 503 and Reddit rate limits) are
+            raised as ServiceUnavailable so a later run can retry the reply. A reply
+            that failed after it was sent may have been posted, it is logged and
+            dropped like other errors. prawcore already retries server errors, so a
+            failed reply is not retried here.
             :param comment_id: str
             :param msg: str
             :return: none
+            :raises ServiceUnavailable: if Reddit is unavailable
             """
             comment = None
+
+            def reply():
+                try:
+                    is_comment_removed = comment.banned_by is True or \
+                        comment.body == "[removed]" or comment.body == '[deleted]'
+                except prawcore.exceptions.RequestException as e:
+                    raise ServiceUnavailable(f"Reddit request failed: {e}") from e
+                except prawcore.exceptions.ResponseException as e:
+                    if e.response.status_code == 429 or e.response.status_code >= 500:
+                        raise ServiceUnavailable(f"Reddit responded with status {e.response.status_code}") from e
+                    raise
+                if is_comment_removed:
+                    return
+
+                try:
+                    comment.reply(msg)
+                except prawcore.exceptions.RequestException as e:
+                    if is_connect_error(e.original_exception):
+                        raise ServiceUnavailable(f"Reddit request failed: {e}") from e
+                    raise RequestOutcomeUnknown(f"Reddit reply failed after it was sent: {e}") from e
+                except prawcore.exceptions.ResponseException as e:
+                    if e.response.status_code in (429, 503):
+                        raise ServiceUnavailable(f"Reddit responded with status {e.response.status_code}") from e
+                    if e.response.status_code >= 500:
+                        raise RequestOutcomeUnknown(f"Reddit responded with status {e.response.status_code}") from e
+                    raise
+                except praw.exceptions.RedditAPIException as e:
+                    if any(item.error_type == "RATELIMIT" for item in e.items):
+                        raise ServiceUnavailable(f"Reddit rate limited reply: {e}") from e
+                    raise
+
             try:
                 comment = self.r.comment(id=comment_id)
                 msg = msg.replace('\n', '  \n  ')
-                is_comment_removed = comment.banned_by is True or \
-                    comment.body == "[removed]" or comment.body == '[deleted]'
-                if not is_comment_removed:
-                    comment.reply(msg)
+                call_with_retry(reply, breaker=self.reddit_breaker)
+            except ServiceUnavailable:
+                raise
             except praw.exceptions.RedditAPIException as re:
                 logger.exception(f"[REDDIT_WITCHER] [HaptikToRedditAdapter] reply_to_comment", comment=comment,
                                  comment_id=comment_id, msg=msg)
@@ -401,15 +549,14 @@ class HaptikToRedditAdapter:
             try:
                 reply = payload.get("message", {}).get("body", {}).get("text", "")
                 message_id = payload.get("user_message_info", {}).get("id")
-                redis_key = f"{message_id}"
-                comment_id = redis_cache.get(redis_key)
+                comment_id = self.state.get_comment_for_message(message_id)
 
                 if not comment_id:
                     return
 
                 if reply == "" or reply == "Bot breaks" or reply == "{}":
                     return
-                redis_cache.delete(redis_key)
+                self.state.forget_message(message_id)
                 self.reply_to_comment(comment_id=comment_id, msg=reply)
                 logger.info(
                     usecase="Reply to comment",
@@ -427,9 +574,10 @@ class HaptikToRedditAdapter:
             return {"status": "success"}
 
     class HaptikToRedditService:
-        def __init__(self, payload):
+        def __init__(self, payload, reddit_service=None):
             self.payload = payload
-            self.reddit_service = HaptikToRedditAdapter.RedditService()
+            self.reddit_service = reddit_service if reddit_service is not None \
+                else HaptikToRedditAdapter.RedditService()
 
         def worker(self):
             """
@@ -442,14 +590,35 @@ class HaptikToRedditAdapter:
         def worker_v2(self):
             """
             Replies to comments, and the ids to answered category in redis cache
-            :return:
+
+            Only one run replies at a time, others skip. Each comment is claimed from
+            the pending set and the lease is checked before every reply.
+            :return: Dict
             """
+            state = self.reddit_service.state
+            lock = LeaseLock("send_replies", ttl=const.send_replies_lock_ttl, state=state)
+            if not lock.acquire():
+                logger.info(
+                    "Replies already being sent, skipping",
+                    usecase="Send Replies",
+                    class_name="HaptikToRedditAdapter",
+                    bot_name="Reddit Witcher"
+                )
+                return {"status": "skipped"}
+            try:
+                self._send_pending_replies(lock)
+            finally:
+                lock.release()
+            return {"status": "success"}
+
+        def _send_pending_replies(self, lock: LeaseLock):
+            state = self.reddit_service.state
             comment_ids = self._get_comment_ids_from_redis()
-            replied_comment_ids = []
             for comment_id in comment_ids:
-                redis_key_for_answered_comment = f"reddit_answered_comment_id_{comment_id}"
-
-                if is_redis_key_already_exists(redis_key_for_answered_comment):
+                lock.ensure_held()
+                if not state.claim_pending_reply(comment_id, lock=lock):
+                    continue
+                if state.is_answered(comment_id):
                     logger.info(
                         "Already Replied",
                         usecase="Reply to comment",
@@ -460,21 +629,25 @@ class HaptikToRedditAdapter:
                     continue
 
                 try:
-                    redis_cache.set(redis_key_for_answered_comment, "yes", 1800)  # Expiry of 30 min
+                    state.mark_answered(comment_id)
                     self.send_replies(comment_id=comment_id)
+                except ServiceUnavailable as e:
+                    state.unmark_answered(comment_id)
+                    state.requeue_pending_reply(comment_id)
+                    logger.exception("[REDDIT_WITCHER] [HaptikReddit] Reddit unavailable, comment requeued",
+                                     comment_id=comment_id, exception=e)
+                    if isinstance(e, CircuitOpen):
+                        return
+                    continue
                 except Exception as e:
                     logger.exception("[REDDIT_WITCHER] [HaptikReddit] Unable to reply to comment",
                                      comment_id=comment_id, exception=e)
-                redis_cache.delete(comment_id)
-                replied_comment_ids.append(comment_id)
+                state.clear_replies(comment_id)
 
-            redis_cache.set("comment_ids", json.dumps([]))
-
-        @staticmethod
-        def _get_comment_ids_from_redis():
+        def _get_comment_ids_from_redis(self):
             comment_ids = []
             try:
-                comment_ids = json.loads(redis_cache.get("comment_ids"))
+                comment_ids = self.reddit_service.state.get_pending_reply_comment_ids()
                 return comment_ids
             except Exception as e:
                 logger.exception("[REDDIT_WITCHER] [SendReplies]"
@@ -482,8 +655,7 @@ class HaptikToRedditAdapter:
                             + " Ignore if there are no Comments")
                 return comment_ids
 
-        @staticmethod
-        def _get_replies_for_comment(comment_id: str):
+        def _get_replies_for_comment(self, comment_id: str):
             """
             Get reply msgs for comment from redis
             :param comment_id:
@@ -491,7 +663,7 @@ class HaptikToRedditAdapter:
             """
             replies = []
             try:
-                replies = json.loads(redis_cache.get(comment_id))
+                replies = self.reddit_service.state.get_replies(comment_id)
                 return replies
             except Exception as e:
                 logger.exception(f"[REDDIT_WITCHER] [SendReplies] Getting Replies from Redis, Exception: {e}"
@@ -524,14 +696,3 @@ class HaptikToRedditAdapter:
                 )
                 return
 
-
-def is_redis_key_already_exists(redis_key_for_answered_comment):
-    """
-    Checks the key is present in the redis cache
-    :param redis_key_for_answered_comment: str
-    :return: bool
-    """
-    redis_value_for_answered_comment = redis_cache.get(redis_key_for_answered_comment)
-    if redis_value_for_answered_comment and redis_value_for_answered_comment == "yes":
-        return True
-    return False
@@ -0,0 +1,125 @@
+"""
+Records sanitized Reddit Witcher traffic for offline replay
+
+When REDDIT_WITCHER_CAPTURE_PATH is set, crawled comments, Haptik send_message
+responses and Haptik webhook bodies are appended to that file as JSON lines.
+Identities are replaced with salted hashes and free text with a mask of the
+same length. Reddit comment ids and Haptik message ids are kept so the
+records can be joined again, see benchmarks/reddit_witcher_replay.py.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+
+import structlog
+from integration.const import reddit_witcher as const
+
+logger = structlog.getLogger("utils")
+
+IDENTITY_KEYS = {"auth_id", "author", "user_name", "username", "name", "full_name", "email", "mobile_no", "phone"}
+TEXT_KEYS = {"text", "body", "message_body", "title"}
+# Bot replies the workers act on, kept so replays behave the same
+CONTROL_TEXTS = {"", "Bot breaks", "{}"}
+
+
+def hash_identity(value: str):
+    """
+    :param value: str
+    :return: str, stable for the same value and salt
+    """
+    digest = hashlib.sha256(f"{const.capture_salt}:{value}".encode()).hexdigest()
+    return f"anon_{digest[:12]}"
+
+
+def mask_text(value: str):
+    """
+    Keeps length and whitespace of the text, so payload sizes stay realistic
+    :param value: str
+    :return: str
+    """
+    return re.sub(r"\S", "x", value)
+
+
+def sanitize(value, key=None):
+    """
+    Recursively replaces identities and free text in a json-like value
+    :param value: Dict/List/str/number
+    :param key: str, key the value was found under
+    :return: sanitized copy
+    """
+    if isinstance(value, dict):
+        return {k: sanitize(v, key=k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key=key) for v in value]
+    if isinstance(value, str):
+        if key in IDENTITY_KEYS:
+            return hash_identity(value)
+        if key in TEXT_KEYS and value not in CONTROL_TEXTS:
+            return mask_text(value)
+    return value
+
+
+class TrafficRecorder:
+    def __init__(self, path=const.capture_path):
+        """
+        :param path: str, JSON lines file, recording is disabled when empty
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, kind: str, **fields):
+        """
+        Appends one record, errors are logged and never reach the caller
+        :param kind: str, "comment", "haptik_response" or "haptik_webhook"
+        :return: none
+        """
+        if not self.enabled:
+            return
+        line = json.dumps({"kind": kind, "ts": time.time(), **fields})
+        try:
+            with self._lock, open(self.path, "a") as capture_file:
+                capture_file.write(line + "\n")
+        except Exception as e:
+            logger.exception("[REDDIT_WITCHER] [Capture] Unable to record traffic", kind=kind, exception=e)
+
+    def record_comment(self, comment: dict, created_utc: float):
+        """
+        :param comment: comment object as queued for Haptik
+        :param created_utc: float
+        :return: none
+        """
+        if self.enabled:
+            self.record("comment", created_utc=created_utc, comment=sanitize(comment))
+
+    def record_haptik_response(self, comment_id: str, response, latency: float):
+        """
+        :param comment_id: str
+        :param response: send_message response
+        :param latency: float, seconds
+        :return: none
+        """
+        if not self.enabled:
+            return
+        try:
+            body = sanitize(response.json())
+        except ValueError:
+            body = None
+        self.record("haptik_response", comment_id=comment_id, status_code=response.status_code,
+                    latency=latency, body=body)
+
+    def record_webhook(self, body: dict):
+        """
+        :param body: Haptik webhook request body
+        :return: none
+        """
+        if self.enabled:
+            self.record("haptik_webhook", body=sanitize(body))
+
+
+recorder = TrafficRecorder()
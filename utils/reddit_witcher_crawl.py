@@ -0,0 +1,221 @@
+"""
+Adaptive expansion of MoreComments stubs for the Reddit Witcher crawl
+
+replace_more(limit=None) makes one API call per MoreComments stub on every run,
+including branches nobody has posted in for days. The planner instead scores
+every stub, expands the best ones first until the per-run budget is spent, and
+remembers in Redis what the expansions of each branch found. A branch whose
+newest comment is older than cold_after is cold and is only expanded again
+once a day.
+
+Branches are keyed by the parent fullname of their stubs. A parent can have
+several stubs: morechildren returns about 100 children and hands the rest back
+as a new stub with the same parent. Stats are therefore accumulated over all
+stubs of a parent within a run. The count of a stub is only compared between
+runs for the first stub of a parent, which is the one in the loaded forest;
+"continue this thread" stubs always have a count of 0 and are judged by the
+comments their expansion finds.
+
+Expanded comments are not inserted into the praw comment forest, so their
+.replies stay empty. CrawlResult keeps the replies of every collected comment
+instead, and marks comments whose replies are still hidden behind a stub.
+"""
+import heapq
+import time
+from collections import defaultdict
+
+import structlog
+from integration.const import reddit_witcher as const
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+logger = structlog.getLogger("utils")
+
+
+class CrawlResult:
+    def __init__(self, comments: list, replies_by_parent: dict, incomplete_parents: set, stats: dict):
+        """
+        :param comments: List of praw.models.Comment
+        :param replies_by_parent: Dict of parent fullname -> List of collected replies
+        :param incomplete_parents: Set of parent fullnames with replies behind an unexpanded stub
+        :param stats: Dict with crawl stats
+        """
+        self.comments = comments
+        self.replies_by_parent = replies_by_parent
+        self.incomplete_parents = incomplete_parents
+        self.stats = stats
+
+    def replies(self, comment):
+        """
+        :param comment: praw.models.Comment
+        :return: List of collected direct replies
+        """
+        return self.replies_by_parent.get(comment.fullname, [])
+
+    def has_all_replies(self, comment):
+        """
+        :param comment: praw.models.Comment
+        :return: bool, False if some replies were not loaded in this crawl
+        """
+        return comment.fullname not in self.incomplete_parents
+
+
+class MoreCommentsPlanner:
+    # Branches never expanded before are tried first
+    UNKNOWN_BRANCH_BONUS = 100
+    # Weight of a comment added behind a stub since the last run
+    NEW_COMMENT_WEIGHT = 10
+    # Branches whose newest comment, or whose parent, is younger than this window get a bonus
+    RECENT_WINDOW = 86400  # 1 day
+    RECENT_ACTIVITY_BONUS = 50
+    RECENT_PARENT_BONUS = 50
+
+    def __init__(self, state: RedditWitcherState, budget=const.crawl_more_comments_budget,
+                 cold_after=const.crawl_cold_branch_after, cold_recheck=const.crawl_cold_branch_recheck, lock=None):
+        """
+        :param state: RedditWitcherState used to remember branches between runs
+        :param budget: int, maximum MoreComments expansions (API calls) per run
+        :param cold_after: int, seconds since the newest comment of a branch before it is cold
+        :param cold_recheck: int, seconds between expansions of a cold branch
+        :param lock: LeaseLock fencing the write of the crawl stats
+        """
+        self.state = state
+        self.budget = budget
+        self.cold_after = cold_after
+        self.cold_recheck = cold_recheck
+        self.lock = lock
+
+    def expand(self, submission, should_stop=None):
+        """
+        Get comments of the submission, expanding MoreComments stubs within the budget
+        :param submission: praw.models.Submission
+        :param should_stop: callable returning True to stop expanding, e.g. on rate limit
+        :return: CrawlResult
+        """
+        from praw.models import MoreComments
+
+        now = time.time()
+        comments = []
+        seen = set()
+        created_by_fullname = {submission.fullname: submission.created_utc}
+        stubs = []
+        all_stubs = []
+        expanded_stubs = set()
+        replies_by_parent = defaultdict(list)
+
+        def collect(items):
+            for item in items:
+                if isinstance(item, MoreComments):
+                    stubs.append(item)
+                    all_stubs.append(item)
+                    continue
+                if item.id in seen:
+                    continue
+                seen.add(item.id)
+                comments.append(item)
+                replies_by_parent[item.parent_id].append(item)
+                created_by_fullname[item.fullname] = item.created_utc
+                collect(item.replies)
+
+        collect(submission.comments)
+
+        memory = self.state.get_crawl_branches([stub.parent_id for stub in stubs])
+        # Count of the first stub seen for each parent in this run
+        hidden_by_parent = {}
+        # Parents with at least one expanded stub in this run, their remainder stubs are never cold
+        expanded_parents = set()
+        heap = []
+        sequence = 0
+        skipped_cold = 0
+
+        def push(stub):
+            nonlocal sequence, skipped_cold
+            branch = memory.get(stub.parent_id)
+            new_comments = 0
+            if stub.parent_id not in hidden_by_parent:
+                hidden_by_parent[stub.parent_id] = stub.count
+                if branch is not None:
+                    new_comments = max(stub.count - branch.get("hidden", 0), 0)
+            if stub.parent_id not in expanded_parents and not new_comments and self._is_cold(branch, now):
+                skipped_cold += 1
+                return
+            score = self._score(branch, stub, new_comments, created_by_fullname.get(stub.parent_id), now)
+            sequence += 1
+            heapq.heappush(heap, (-score, sequence, stub))
+
+        for stub in stubs:
+            push(stub)
+
+        calls = 0
+        updated = {}
+        while heap and calls < self.budget:
+            if should_stop and should_stop():
+                break
+            _, _, stub = heapq.heappop(heap)
+            calls += 1
+            try:
+                expanded = stub.comments()
+            except Exception as e:
+                # Keep the comments collected so far, the branch is retried on the next run
+                logger.exception("[REDDIT_WITCHER] [MoreCommentsPlanner] Expanding MoreComments failed",
+                                 parent_id=stub.parent_id, exception=e)
+                break
+            expanded_stubs.add(id(stub))
+            expanded_parents.add(stub.parent_id)
+
+            stubs.clear()
+            collected = len(comments)
+            collect(expanded)
+            found = comments[collected:]
+
+            # Newest comment known under the branch, from this run's expansions or earlier runs
+            previous = updated.get(stub.parent_id) or memory.get(stub.parent_id) or {}
+            latest = max([comment.created_utc for comment in found] + [previous.get("latest", 0)])
+            updated[stub.parent_id] = {
+                "latest": latest,
+                "hidden": hidden_by_parent[stub.parent_id],
+                "expanded_at": now,
+            }
+
+            if stubs:
+                memory.update(self.state.get_crawl_branches(
+                    [new_stub.parent_id for new_stub in stubs if new_stub.parent_id not in memory]
+                ))
+                for new_stub in stubs:
+                    push(new_stub)
+
+        # Stubs left in the heap keep their old stats, so they still look new on the next run
+        self.state.save_crawl_branches(updated, lock=self.lock)
+        stats = {
+            "comments": len(comments),
+            "expanded": calls,
+            "skipped_cold": skipped_cold,
+            "remaining": len(heap),
+        }
+        logger.info(usecase="Get Comments", class_name="MoreCommentsPlanner", bot_name="Reddit Witcher", **stats)
+        incomplete_parents = {stub.parent_id for stub in all_stubs if id(stub) not in expanded_stubs}
+        return CrawlResult(comments, replies_by_parent, incomplete_parents, stats)
+
+    def _is_cold(self, branch, now):
+        """
+        A branch is cold when its newest comment is older than cold_after and
+        it was expanded within the last cold_recheck seconds
+        """
+        if branch is None or "latest" not in branch:
+            return False
+        return now - branch["latest"] >= self.cold_after and now - branch["expanded_at"] < self.cold_recheck
+
+    def _score(self, branch, stub, new_comments, parent_created, now):
+        """
+        Ranks a stub by comments added behind it since the last run, comments hidden
+        behind it, how recently its branch was active and how recently its parent was posted
+        """
+        score = stub.count + new_comments * self.NEW_COMMENT_WEIGHT
+        if branch is None or "latest" not in branch:
+            score += self.UNKNOWN_BRANCH_BONUS
+        else:
+            idle = max(now - branch["latest"], 0)
+            score += self.RECENT_ACTIVITY_BONUS * max(1 - idle / self.RECENT_WINDOW, 0)
+        if parent_created is not None:
+            age = max(now - parent_created, 0)
+            score += self.RECENT_PARENT_BONUS * max(1 - age / self.RECENT_WINDOW, 0)
+        return score
@@ -0,0 +1,165 @@
+"""
+Retries and circuit breakers for the Haptik and Reddit calls of the Reddit Witcher bot
+
+Every cron run is a new process, so breaker state is kept in Redis and shared
+by all runs and web workers. A breaker opens after circuit_failure_threshold
+failures in a row and rejects calls for circuit_reset_timeout seconds. After
+that it lets calls through again. The first failure opens it again and the
+first success closes it.
+
+A POST that timed out while waiting for the response may still have been
+processed, so it is neither retried nor requeued: it raises
+RequestOutcomeUnknown, which counts against the breaker and drops the work.
+Only failures that clearly happened before the request was handled, like
+connect errors, 429 and 503, are ServiceUnavailable.
+"""
+import random
+import time
+
+import requests
+import structlog
+import urllib3
+from integration.const import reddit_witcher as const
+from integration.utils.reddit_witcher_state import RedditWitcherState
+
+logger = structlog.getLogger("utils")
+
+
+class ServiceUnavailable(Exception):
+    """
+    Remote service failed in a way that may succeed later, the work should be requeued
+    """
+    pass
+
+
+class CircuitOpen(ServiceUnavailable):
+    pass
+
+
+class RequestOutcomeUnknown(Exception):
+    """
+    Request failed after it was sent, the remote side may have processed it
+    """
+    pass
+
+
+def is_connect_error(exception):
+    """
+    Checks if a requests exception happened before the request reached the server
+    :param exception: Exception
+    :return: bool
+    """
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exception, requests.exceptions.ConnectionError) and exception.args:
+        reason = getattr(exception.args[0], "reason", exception.args[0])
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+
+class CircuitBreaker:
+    CIRCUITS = "circuits"
+
+    def __init__(self, name: str, state: RedditWitcherState, failure_threshold=const.circuit_failure_threshold,
+                 reset_timeout=const.circuit_reset_timeout):
+        """
+        :param name: str, e.g. "haptik"
+        :param state: RedditWitcherState whose namespace and connection are used
+        :param failure_threshold: int, consecutive failures that open the circuit
+        :param reset_timeout: int, seconds the circuit stays open
+        """
+        self.name = name
+        self.redis = state.redis
+        self.key = state.key(self.CIRCUITS)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    @property
+    def _failures_field(self):
+        return f"{self.name}:failures"
+
+    @property
+    def _opened_until_field(self):
+        return f"{self.name}:opened_until"
+
+    def allow(self):
+        """
+        :return: bool, False while the circuit is open
+        """
+        opened_until = self.redis.hget(self.key, self._opened_until_field)
+        return not opened_until or float(opened_until) <= time.time()
+
+    def record_success(self):
+        # Most calls succeed on a closed circuit, only write when there is something to reset
+        failures, opened_until = self.redis.hmget(self.key, self._failures_field, self._opened_until_field)
+        if not int(failures or 0) and not float(opened_until or 0):
+            return
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key, mapping={self._failures_field: 0, self._opened_until_field: 0})
+        pipe.expire(self.key, const.state_ttl)
+        pipe.execute()
+
+    def record_failure(self):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.key, self._failures_field, 1)
+        pipe.hget(self.key, self._opened_until_field)
+        pipe.expire(self.key, const.state_ttl)
+        failures, opened_until, _ = pipe.execute()
+        half_open = bool(opened_until) and float(opened_until) > 0
+        if half_open or failures >= self.failure_threshold:
+            self.redis.hset(self.key, mapping={
+                self._failures_field: 0,
+                self._opened_until_field: time.time() + self.reset_timeout,
+            })
+            logger.info("Circuit opened", usecase="Circuit Breaker", circuit=self.name, failures=failures,
+                        reset_timeout=self.reset_timeout, bot_name="Reddit Witcher")
+
+
+def call_with_retry(func, breaker: CircuitBreaker = None, attempts=1, base_delay=const.retry_base_delay,
+                    max_delay=const.retry_max_delay, deadline=None, is_retryable=None):
+    """
+    Calls func, retrying failures with exponential backoff and full jitter
+
+    Only retryable failures count against the breaker and are retried.
+    RequestOutcomeUnknown counts against the breaker but is never retried.
+    Others are raised straight away.
+    :param func: callable without arguments
+    :param breaker: CircuitBreaker checked before and updated after every attempt
+    :param attempts: int, maximum number of calls
+    :param base_delay: float, seconds before the first retry, doubled for every retry
+    :param max_delay: float, upper bound of a single backoff
+    :param deadline: float, seconds after which no further attempt is started
+    :param is_retryable: callable taking the exception, defaults to ServiceUnavailable only
+    :return: return value of func
+    :raises CircuitOpen: if the breaker rejects the call
+    """
+    if is_retryable is None:
+        def is_retryable(e):
+            return isinstance(e, ServiceUnavailable)
+
+    started = time.monotonic()
+    for attempt in range(1, attempts + 1):
+        if breaker and not breaker.allow():
+            raise CircuitOpen(f"Circuit '{breaker.name}' is open")
+        try:
+            result = func()
+        except RequestOutcomeUnknown:
+            if breaker:
+                breaker.record_failure()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if breaker:
+                breaker.record_failure()
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            out_of_time = deadline is not None and time.monotonic() - started + delay >= deadline
+            if attempt == attempts or out_of_time:
+                raise
+            logger.info("Retrying call", usecase="Retry", function=getattr(func, "__name__", str(func)),
+                        attempt=attempt, delay=delay, exception=str(e), bot_name="Reddit Witcher")
+            time.sleep(delay)
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
@@ -0,0 +1,596 @@
+"""
+Namespaced Redis state for the Reddit Witcher bot
+
+Every key lives under "<namespace>:<version>:" so the bot can share a Redis
+instance with other integrations and the layout can be changed by bumping
+the version. Per comment flags are stored as fields of a few hashes instead of
+one string key per comment, and every key carries an expiry.
+
+Layout (prefix "reddit_witcher:v1:"):
+    comment_queue       hash   comment id -> comment json, waiting to be sent to Haptik
+    messages            hash   Haptik message id -> Reddit comment id
+    messages_index      zset   Haptik message id scored by creation time, used by the GC job
+    replies             hash   comment id -> json list of bot replies
+    pending_replies     set    comment ids with replies waiting to be posted on Reddit
+    answered            hash   comment id -> expiry timestamp
+    bot_break           hash   comment id -> expiry timestamp
+    crawl_branches      hash   parent fullname of a MoreComments stub -> json crawl stats
+    circuits            hash   circuit breaker failure counts and open deadlines
+"""
+import json
+import re
+import time
+
+import structlog
+from django_redis import get_redis_connection
+from integration.const import reddit_witcher as const
+
+redis_cache = get_redis_connection('redis')
+redis_cache.connection_pool.connection_kwargs["decode_responses"] = True
+redis_cache.connection_pool.reset()
+
+logger = structlog.getLogger("utils")
+
+# Appends a reply to the json list stored in the replies hash and marks the
+# comment as pending in one round trip, so concurrent webhooks do not drop replies.
+ADD_REPLY_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local replies = {}
+if current then
+    replies = cjson.decode(current)
+end
+table.insert(replies, ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(replies))
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return #replies
+"""
+
+# Runs one command on KEYS[2] only while KEYS[1] still holds the fencing token
+# ARGV[1], returns -1 otherwise. ARGV[2] is an expiry for KEYS[2] in seconds, 0 for none.
+FENCED_COMMAND_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+local result = redis.call(ARGV[3], KEYS[2], unpack(ARGV, 4))
+if tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return result
+"""
+
+# Stores a flag with its expiry timestamp and only ever extends the expiry of
+# the hash, so a short lived flag can not cut the lifetime of longer ones.
+# EXPIRE ... GT is not used because it never sets an expiry on a key without one.
+SET_FLAG_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+local ttl_ms = tonumber(ARGV[3])
+if redis.call('PTTL', KEYS[1]) < ttl_ms then
+    redis.call('PEXPIRE', KEYS[1], ttl_ms)
+end
+"""
+
+# Deletes the replies of the comments in ARGV[2..] which are not pending, while
+# KEYS[1] still holds the fencing token ARGV[1]. Returns -1 if the lease is lost.
+# Checked per comment inside Redis so a reply added meanwhile by a webhook is kept.
+COLLECT_ORPHANED_REPLIES_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+local removed = 0
+for i = 2, #ARGV do
+    if redis.call('SISMEMBER', KEYS[3], ARGV[i]) == 0 then
+        removed = removed + redis.call('HDEL', KEYS[2], ARGV[i])
+    end
+end
+return removed
+"""
+
+
+class LockLost(Exception):
+    pass
+
+
+class RedditWitcherState:
+    COMMENT_QUEUE = "comment_queue"
+    MESSAGES = "messages"
+    MESSAGES_INDEX = "messages_index"
+    REPLIES = "replies"
+    PENDING_REPLIES = "pending_replies"
+    ANSWERED = "answered"
+    BOT_BREAK = "bot_break"
+    CRAWL_BRANCHES = "crawl_branches"
+
+    GC_BATCH_SIZE = 500
+
+    def __init__(self, redis_client=None, namespace=const.redis_namespace, version=const.redis_state_version):
+        """
+        :param redis_client: redis connection, defaults to the shared 'redis' connection
+        :param namespace: str
+        :param version: str
+        """
+        self.redis = redis_client if redis_client is not None else redis_cache
+        self.prefix = f"{namespace}:{version}"
+        self._add_reply = self.redis.register_script(ADD_REPLY_SCRIPT)
+        self._set_flag_script = self.redis.register_script(SET_FLAG_SCRIPT)
+        self._fenced_command = self.redis.register_script(FENCED_COMMAND_SCRIPT)
+        self._collect_orphaned_replies_script = self.redis.register_script(COLLECT_ORPHANED_REPLIES_SCRIPT)
+
+    def key(self, name: str):
+        """
+        Fully qualified redis key for a state name
+        :param name: str
+        :return: str
+        """
+        return f"{self.prefix}:{name}"
+
+    def _fenced(self, lock, key: str, command: str, *args, ttl=0):
+        """
+        Runs a write only if lock still holds its lease, checked atomically by Redis
+        :param lock: LeaseLock
+        :raises LockLost: if the lease expired or another run holds it now
+        """
+        result = self._fenced_command(keys=[lock.lock_key, key], args=[lock.token, ttl, command, *args])
+        if result == -1:
+            raise LockLost(f"Lease '{lock.name}' with fencing token {lock.token} is no longer held")
+        return result
+
+    # Reddit -> Haptik comment queue
+
+    def enqueue_comment(self, comment: dict, lock=None):
+        """
+        Adds comment to the queue of comments to be sent to Haptik
+        :param comment: {
+            "id": str,
+            "body": str,
+            "author": str
+        }
+        :param lock: LeaseLock, when given the write is fenced by its token
+        :return: bool, False if the comment is already queued
+        """
+        key = self.key(self.COMMENT_QUEUE)
+        if lock:
+            return bool(self._fenced(lock, key, "HSETNX", comment["id"], json.dumps(comment), ttl=const.state_ttl))
+        pipe = self.redis.pipeline()
+        pipe.hsetnx(key, comment["id"], json.dumps(comment))
+        pipe.expire(key, const.state_ttl)
+        added, _ = pipe.execute()
+        return bool(added)
+
+    def get_queued_comments(self):
+        """
+        Get comments waiting to be sent to Haptik
+        :return: List of comment object
+        """
+        return [json.loads(comment) for comment in self.redis.hvals(self.key(self.COMMENT_QUEUE))]
+
+    def claim_comment(self, comment_id: str, lock=None):
+        """
+        Removes comment from the queue. Only one caller can claim a comment.
+        :param comment_id: str
+        :param lock: LeaseLock, when given the claim is fenced by its token
+        :return: bool, True if this caller removed it
+        """
+        if lock:
+            return self._fenced(lock, self.key(self.COMMENT_QUEUE), "HDEL", comment_id) == 1
+        return self.redis.hdel(self.key(self.COMMENT_QUEUE), comment_id) == 1
+
+    def requeue_comment(self, comment: dict):
+        """
+        Puts a claimed comment back after sending it failed
+        :param comment: comment object
+        :return: none
+        """
+        key = self.key(self.COMMENT_QUEUE)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, comment["id"], json.dumps(comment))
+        pipe.expire(key, const.state_ttl)
+        pipe.execute()
+
+    # Haptik message id -> Reddit comment id
+
+    def map_message_to_comment(self, message_id, comment_id: str):
+        """
+        Stores which Reddit comment a Haptik message was created for
+        :param message_id: int/str
+        :param comment_id: str
+        :return: none
+        """
+        messages_key = self.key(self.MESSAGES)
+        index_key = self.key(self.MESSAGES_INDEX)
+        pipe = self.redis.pipeline()
+        pipe.hset(messages_key, str(message_id), comment_id)
+        pipe.zadd(index_key, {str(message_id): time.time()})
+        pipe.expire(messages_key, const.state_ttl)
+        pipe.expire(index_key, const.state_ttl)
+        pipe.execute()
+
+    def get_comment_for_message(self, message_id):
+        """
+        :param message_id: int/str
+        :return: str or None
+        """
+        return self.redis.hget(self.key(self.MESSAGES), str(message_id))
+
+    def forget_message(self, message_id):
+        """
+        :param message_id: int/str
+        :return: none
+        """
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key(self.MESSAGES), str(message_id))
+        pipe.zrem(self.key(self.MESSAGES_INDEX), str(message_id))
+        pipe.execute()
+
+    # Haptik -> Reddit replies
+
+    def add_reply(self, comment_id: str, reply: str):
+        """
+        Appends bot reply for a comment and marks the comment as pending
+        :param comment_id: str
+        :param reply: str
+        :return: int, number of replies stored for the comment
+        """
+        return self._add_reply(
+            keys=[self.key(self.REPLIES), self.key(self.PENDING_REPLIES)],
+            args=[comment_id, reply, const.state_ttl]
+        )
+
+    def get_replies(self, comment_id: str):
+        """
+        :param comment_id: str
+        :return: List of replies
+        """
+        replies = self.redis.hget(self.key(self.REPLIES), comment_id)
+        return json.loads(replies) if replies else []
+
+    def get_pending_reply_comment_ids(self):
+        """
+        :return: List of comment ids with replies waiting to be posted
+        """
+        return list(self.redis.smembers(self.key(self.PENDING_REPLIES)))
+
+    def claim_pending_reply(self, comment_id: str, lock=None):
+        """
+        Removes comment from the pending set. Only one caller can claim a comment.
+        :param comment_id: str
+        :param lock: LeaseLock, when given the claim is fenced by its token
+        :return: bool, True if this caller removed it
+        """
+        if lock:
+            return self._fenced(lock, self.key(self.PENDING_REPLIES), "SREM", comment_id) == 1
+        return self.redis.srem(self.key(self.PENDING_REPLIES), comment_id) == 1
+
+    def requeue_pending_reply(self, comment_id: str):
+        """
+        Puts a claimed comment back after replying failed, its replies are kept
+        :param comment_id: str
+        :return: none
+        """
+        key = self.key(self.PENDING_REPLIES)
+        pipe = self.redis.pipeline()
+        pipe.sadd(key, comment_id)
+        pipe.expire(key, const.state_ttl)
+        pipe.execute()
+
+    def clear_replies(self, comment_id: str):
+        """
+        :param comment_id: str
+        :return: none
+        """
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key(self.REPLIES), comment_id)
+        pipe.srem(self.key(self.PENDING_REPLIES), comment_id)
+        pipe.execute()
+
+    # Answered and bot break flags
+
+    def mark_answered(self, comment_id: str, ttl=const.answered_comment_ttl):
+        self._set_flag(self.ANSWERED, comment_id, ttl)
+
+    def is_answered(self, comment_id: str):
+        return self._is_flag_set(self.ANSWERED, comment_id)
+
+    def unmark_answered(self, comment_id: str):
+        self.redis.hdel(self.key(self.ANSWERED), comment_id)
+
+    def mark_bot_break(self, comment_id: str, ttl=const.bot_break_comment_ttl):
+        self._set_flag(self.BOT_BREAK, comment_id, ttl)
+
+    def is_bot_break(self, comment_id: str):
+        return self._is_flag_set(self.BOT_BREAK, comment_id)
+
+    def _set_flag(self, name: str, comment_id: str, ttl: int):
+        """
+        Hash fields can not expire on their own, so the field stores its expiry
+        timestamp and the whole hash expires after the latest one.
+        """
+        self._set_flag_until(name, comment_id, time.time() + ttl)
+
+    def _set_flag_until(self, name: str, comment_id: str, expires_at: float):
+        ttl_ms = max(int((expires_at - time.time()) * 1000), 1)
+        self._set_flag_script(keys=[self.key(name)], args=[comment_id, expires_at, ttl_ms])
+
+    def _is_flag_set(self, name: str, comment_id: str):
+        expires_at = self.redis.hget(self.key(name), comment_id)
+        return bool(expires_at) and float(expires_at) > time.time()
+
+    # Comment crawl memory
+
+    def get_crawl_branches(self, branch_ids: list):
+        """
+        :param branch_ids: List of parent fullnames
+        :return: Dict of branch id -> {"latest": float, "hidden": int, "expanded_at": float}
+        """
+        if not branch_ids:
+            return {}
+        values = self.redis.hmget(self.key(self.CRAWL_BRANCHES), branch_ids)
+        return {branch_id: json.loads(value) for branch_id, value in zip(branch_ids, values) if value}
+
+    def save_crawl_branches(self, branches: dict, lock=None):
+        """
+        :param branches: Dict of branch id -> crawl stats
+        :param lock: LeaseLock, when given the write is fenced by its token
+        :return: none
+        """
+        if not branches:
+            return
+        key = self.key(self.CRAWL_BRANCHES)
+        if lock:
+            fields = [value for branch_id, stats in branches.items() for value in (branch_id, json.dumps(stats))]
+            self._fenced(lock, key, "HSET", *fields, ttl=const.state_ttl)
+            return
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={branch_id: json.dumps(stats) for branch_id, stats in branches.items()})
+        pipe.expire(key, const.state_ttl)
+        pipe.execute()
+
+    # Migration from the legacy un-namespaced keys
+
+    LEGACY_ANSWERED_PATTERN = "reddit_answered_comment_id_*"
+    LEGACY_BOT_BREAK_PATTERN = "reddit_bot_break_comment_id_*"
+    LEGACY_MESSAGE_ID = re.compile(r"^[0-9]+$")
+    LEGACY_COMMENT_ID = re.compile(r"^[0-9a-z]{4,12}$")
+
+    def migrate_legacy_keys(self):
+        """
+        One time move of the state written before the state store existed
+
+        Answered and bot break flags keep the remaining TTL of their legacy key.
+        The queued comments in "reddit_comments" and the replies of the comments
+        listed in "comment_ids" are moved as well.
+
+        The legacy bare message id and reply keys were written without a TTL and
+        nothing deleted them, so they are found by shape (see _migrate_legacy_bare_keys).
+        Message ids are moved into messages, so webhooks for messages sent before
+        the deploy still find their comment, and the GC job expires them later.
+        Reply keys of comments that were dropped from "comment_ids" get an expiry of
+        message_mapping_ttl, they were never going to be posted.
+        :return: Dict with number of migrated entries per category
+        """
+        migrated = {
+            "answered": self._migrate_legacy_flags(self.LEGACY_ANSWERED_PATTERN, self.ANSWERED,
+                                                   const.answered_comment_ttl),
+            "bot_break": self._migrate_legacy_flags(self.LEGACY_BOT_BREAK_PATTERN, self.BOT_BREAK,
+                                                    const.bot_break_comment_ttl),
+            "queued_comments": 0,
+            "replies": 0,
+        }
+
+        reddit_comments = self.redis.get("reddit_comments")
+        if reddit_comments:
+            for comment in json.loads(reddit_comments):
+                migrated["queued_comments"] += int(self.enqueue_comment(comment))
+        self.redis.delete("reddit_comments")
+
+        comment_ids = self.redis.get("comment_ids")
+        for comment_id in json.loads(comment_ids) if comment_ids else []:
+            replies = self.redis.get(comment_id)
+            for reply in json.loads(replies) if replies else []:
+                self.add_reply(comment_id, reply)
+                migrated["replies"] += 1
+            self.redis.delete(comment_id)
+        self.redis.delete("comment_ids")
+        migrated.update(self._migrate_legacy_bare_keys())
+
+        logger.info("Legacy state migrated", usecase="State Migration", migrated=migrated,
+                    bot_name="Reddit Witcher")
+        return migrated
+
+    def _migrate_legacy_flags(self, pattern: str, name: str, default_ttl: int):
+        prefix = pattern.rstrip("*")
+        migrated = 0
+        for key in list(self.redis.scan_iter(match=pattern, count=self.GC_BATCH_SIZE)):
+            pipe = self.redis.pipeline()
+            pipe.get(key)
+            pipe.pttl(key)
+            value, ttl_ms = pipe.execute()
+            if value == "yes":
+                # -1 means the key never expires, keep the usual lifetime in that case
+                ttl = ttl_ms / 1000 if ttl_ms > 0 else default_ttl
+                self._set_flag_until(name, key[len(prefix):], time.time() + ttl)
+                migrated += 1
+            self.redis.delete(key)
+        return migrated
+
+    def _migrate_legacy_bare_keys(self):
+        """
+        Legacy message id keys are all digit names holding a comment id, legacy reply
+        keys are comment id names holding a json list of strings. Both are plain
+        strings without an expiry, keys of other shapes are left alone.
+        :return: Dict with number of migrated entries per category
+        """
+        migrated = {"messages": 0, "expired_replies": 0}
+        for keys in self._legacy_bare_key_batches():
+            pipe = self.redis.pipeline()
+            for key in keys:
+                pipe.type(key)
+                pipe.pttl(key)
+            results = pipe.execute()
+            candidates = [
+                key for key, key_type, ttl_ms in zip(keys, results[::2], results[1::2])
+                if key_type == "string" and ttl_ms == -1
+            ]
+            if not candidates:
+                continue
+            for key, value in zip(candidates, self.redis.mget(candidates)):
+                if value is None:
+                    continue
+                if self.LEGACY_MESSAGE_ID.match(key) and self.LEGACY_COMMENT_ID.match(value):
+                    self.map_message_to_comment(key, value)
+                    self.redis.delete(key)
+                    migrated["messages"] += 1
+                elif _is_reply_list(value):
+                    self.redis.expire(key, const.message_mapping_ttl)
+                    migrated["expired_replies"] += 1
+        return migrated
+
+    def _legacy_bare_key_batches(self):
+        batch = []
+        for key in self.redis.scan_iter(count=self.GC_BATCH_SIZE):
+            if self.LEGACY_COMMENT_ID.match(key) or self.LEGACY_MESSAGE_ID.match(key):
+                batch.append(key)
+            if len(batch) >= self.GC_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Garbage collection
+
+    def collect_garbage(self, message_ttl=const.message_mapping_ttl):
+        """
+        Removes state that nothing will read anymore:
+        1. message id mappings older than message_ttl (Haptik has stopped replying to them)
+        2. message ids present in only one of messages / messages_index
+        3. expired answered and bot break flags
+        4. replies for comments which are not pending anymore, skipped while replies are being sent
+        5. crawl stats of branches which were not expanded for state_ttl
+
+        :param message_ttl: int, seconds
+        :return: Dict with number of removed entries per category
+        """
+        return {
+            "expired_messages": self._collect_expired_messages(message_ttl),
+            "orphaned_messages": self._collect_orphaned_messages(),
+            "expired_answered": self._collect_expired_flags(self.ANSWERED),
+            "expired_bot_break": self._collect_expired_flags(self.BOT_BREAK),
+            "orphaned_replies": self._collect_orphaned_replies(),
+            "stale_crawl_branches": self._collect_stale_crawl_branches(),
+        }
+
+    def _collect_expired_messages(self, message_ttl):
+        index_key = self.key(self.MESSAGES_INDEX)
+        cutoff = time.time() - message_ttl
+        removed = 0
+        while True:
+            message_ids = self.redis.zrangebyscore(index_key, "-inf", cutoff, start=0, num=self.GC_BATCH_SIZE)
+            if not message_ids:
+                return removed
+            pipe = self.redis.pipeline()
+            pipe.hdel(self.key(self.MESSAGES), *message_ids)
+            pipe.zrem(index_key, *message_ids)
+            pipe.execute()
+            removed += len(message_ids)
+
+    def _collect_orphaned_messages(self):
+        messages_key = self.key(self.MESSAGES)
+        index_key = self.key(self.MESSAGES_INDEX)
+        removed = 0
+        for message_ids in self._hscan_batches(messages_key):
+            pipe = self.redis.pipeline()
+            for message_id in message_ids:
+                pipe.zscore(index_key, message_id)
+            orphans = [message_id for message_id, score in zip(message_ids, pipe.execute()) if score is None]
+            if orphans:
+                self.redis.hdel(messages_key, *orphans)
+                removed += len(orphans)
+
+        for message_ids in self._zscan_batches(index_key):
+            pipe = self.redis.pipeline()
+            for message_id in message_ids:
+                pipe.hexists(messages_key, message_id)
+            orphans = [message_id for message_id, exists in zip(message_ids, pipe.execute()) if not exists]
+            if orphans:
+                self.redis.zrem(index_key, *orphans)
+                removed += len(orphans)
+        return removed
+
+    def _collect_expired_flags(self, name: str):
+        key = self.key(name)
+        now = time.time()
+        removed = 0
+        for fields in self._hscan_batches(key, with_values=True):
+            expired = [comment_id for comment_id, expires_at in fields if float(expires_at) <= now]
+            if expired:
+                self.redis.hdel(key, *expired)
+                removed += len(expired)
+        return removed
+
+    def _collect_orphaned_replies(self):
+        # A comment claimed by worker_v2 is not pending while its replies are posted,
+        # so they are only collected under the send_replies lease
+        from integration.utils.reddit_witcher_lock import LeaseLock
+
+        lock = LeaseLock("send_replies", ttl=const.send_replies_lock_ttl, state=self)
+        if not lock.acquire():
+            logger.info("Replies are being sent, orphaned replies not collected", usecase="State GC",
+                        bot_name="Reddit Witcher")
+            return 0
+        replies_key = self.key(self.REPLIES)
+        pending_key = self.key(self.PENDING_REPLIES)
+        removed = 0
+        try:
+            for comment_ids in self._hscan_batches(replies_key):
+                result = self._collect_orphaned_replies_script(
+                    keys=[lock.lock_key, replies_key, pending_key], args=[lock.token, *comment_ids]
+                )
+                if result == -1:
+                    raise LockLost(f"Lease '{lock.name}' with fencing token {lock.token} is no longer held")
+                removed += result
+        finally:
+            lock.release()
+        return removed
+
+    def _collect_stale_crawl_branches(self):
+        key = self.key(self.CRAWL_BRANCHES)
+        cutoff = time.time() - const.state_ttl
+        removed = 0
+        for fields in self._hscan_batches(key, with_values=True):
+            stale = [branch_id for branch_id, stats in fields if json.loads(stats)["expanded_at"] <= cutoff]
+            if stale:
+                self.redis.hdel(key, *stale)
+                removed += len(stale)
+        return removed
+
+    def _hscan_batches(self, key: str, with_values=False):
+        """
+        Yields hash fields in batches, collected before yielding so callers can delete while iterating
+        """
+        batch = []
+        for field, value in list(self.redis.hscan_iter(key, count=self.GC_BATCH_SIZE)):
+            batch.append((field, value) if with_values else field)
+            if len(batch) >= self.GC_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _zscan_batches(self, key: str):
+        batch = []
+        for member, _ in list(self.redis.zscan_iter(key, count=self.GC_BATCH_SIZE)):
+            batch.append(member)
+            if len(batch) >= self.GC_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _is_reply_list(value: str):
+    try:
+        replies = json.loads(value)
+    except ValueError:
+        return False
+    return isinstance(replies, list) and all(isinstance(reply, str) for reply in replies)
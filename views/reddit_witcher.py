@@ -5,14 +5,12 @@ import structlog
 from django.http import JsonResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django_redis import get_redis_connection
+from integration.const import reddit_witcher as const
 from integration.utils import reddit_witcher
+from integration.utils.reddit_witcher_capture import recorder
+from integration.utils.reddit_witcher_state import RedditWitcherState
 from integration.views.base_integration import IntegrationBaseClass
 
-redis_cache = get_redis_connection('redis')
-redis_cache.connection_pool.connection_kwargs["decode_responses"] = True
-redis_cache.connection_pool.reset()
-
 logger = structlog.getLogger('utils')
 
 
@@ -49,6 +47,9 @@ class RedditToHaptikAdapter(IntegrationBaseClass):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class HaptikToRedditAdapter(IntegrationBaseClass):
+    # Redis namespace of the bot state, replays pass their own through as_view
+    state_namespace = const.redis_namespace
+
     def post(self, request):
         """
         Gets Bot Responses from Haptik
@@ -67,30 +68,22 @@ class HaptikToRedditAdapter(IntegrationBaseClass):
             logger.info(usecase="Haptik To Reddit", Response=str(json.loads(request.body)), bot_name="Reddit Witcher")
             response = {}
             req_body = json.loads(request.body)
+            recorder.record_webhook(req_body)
             message_id = req_body.get("user_message_info", {}).get("id")
-            comment_id = redis_cache.get(str(message_id))
+            state = RedditWitcherState(namespace=self.state_namespace)
+            comment_id = state.get_comment_for_message(message_id)
+            if not comment_id:
+                logger.info(
+                    "Unknown message id", usecase="Haptik To Reddit", message_id=message_id, bot_name="Reddit Witcher"
+                )
+                return JsonResponse({'message': response}, status=status_code)
+
             reply = req_body.get("message", {}).get("body", {}).get("text", "")
             if reply != "" and reply != "Bot breaks" and reply != "{}":
-                replies = redis_cache.get(comment_id)
-                if replies:
-                    replies = json.loads(replies)
-                    replies.append(reply)
-                else:
-                    replies = [reply]
-                redis_cache.set(comment_id, json.dumps(replies))
-
-                comment_ids = redis_cache.get("comment_ids")
-                if comment_ids:
-                    comment_ids = json.loads(comment_ids)
-                    if comment_id not in comment_ids:
-                        comment_ids.append(comment_id)
-                else:
-                    comment_ids = [comment_id]
-                redis_cache.set("comment_ids", json.dumps(comment_ids))
+                state.add_reply(comment_id, reply)
 
             if reply == "Bot breaks":
-                redis_key_for_answered_comment = f"reddit_bot_break_comment_id_{comment_id}"
-                redis_cache.set(redis_key_for_answered_comment, "yes", 2592000)  # Expiry of 1 month
+                state.mark_bot_break(comment_id)
                 logger.info(usecase="Haptik To Reddit", comment_id=comment_id, bot_name="Reddit Witcher")
 
             resp = {'message': response}